@@ -0,0 +1,116 @@
+'''
+This module defines the computer controlled opponent.
+Includes:
+    1. CPU controller
+'''
+import math
+import random
+import time
+from physics import Puck, UP, DOWN, LEFT, RIGHT, GOAL_TOP, GOAL_BOTTOM
+
+#Reaction delay in ticks, prediction horizon in ticks, aim error in pixels,
+#and the time budget per tick in seconds
+DIFFICULTIES = {
+    'easy': {'reaction': 12, 'horizon': 45, 'error': 40, 'budget': 0.0003},
+    'medium': {'reaction': 5, 'horizon': 120, 'error': 15, 'budget': 0.0006},
+    'hard': {'reaction': 0, 'horizon': 240, 'error': 0, 'budget': 0.001}
+    }
+
+class CPUController:
+    ''' Class that drives a mallet by predicting the puck's path '''
+    def __init__(self, difficulty='medium', seed=None):
+        self.difficulty = difficulty
+        settings = DIFFICULTIES[difficulty]
+        self.reaction = settings['reaction']
+        self.horizon = settings['horizon']
+        self.error = settings['error']
+        self.budget = settings['budget']
+        self.rng = random.Random(seed)
+        self.key = None
+        self.path = []
+        self.ghost = None
+        self.frame = self.startFrame = 0
+        self.offset = (0, 0)
+        self.predictions = 0
+
+    def velocityKey(self, puck):
+        return (puck.vx, puck.vy, bool(puck.lastTouched))
+
+    def startPrediction(self, puck):
+        ''' Starts predicting the path of a puck from its current state '''
+        self.key = self.velocityKey(puck)
+        self.ghost = Puck(puck.x, puck.y, puck.r, puck.xLimits, puck.yLimits)
+        self.ghost.vel, self.ghost.vx, self.ghost.vy = puck.vel, puck.vx, puck.vy
+        self.ghost.lastTouched = puck.lastTouched
+        self.path = []
+        self.startFrame = self.frame
+        self.offset = (
+            self.rng.uniform(-self.error, self.error),
+            self.rng.uniform(-self.error, self.error)
+            )
+        self.predictions += 1
+
+    def extendPrediction(self, deadline):
+        ''' Extends the predicted path until the horizon or the deadline '''
+        ghost = self.ghost
+        while ghost and len(self.path) < self.horizon:
+            ghost.move()
+            self.path.append((ghost.x, ghost.y))
+            if ghost.scored or not ghost.lastTouched:
+                break
+            if len(self.path) % 16 == 0 and time.perf_counter() > deadline:
+                return
+        self.ghost = None
+
+    def isStale(self, puck):
+        ''' Checks whether the puck has left the predicted path '''
+        if self.velocityKey(puck) != self.key:
+            return True
+        i = self.frame - self.startFrame - 1
+        if 0 <= i < len(self.path):
+            x, y = self.path[i]
+            return abs(x - puck.x) > 1 or abs(y - puck.y) > 1
+        return i >= len(self.path) and not self.ghost
+
+    def chooseTarget(self, match, mallet):
+        ''' Returns the position the mallet should move to '''
+        puck = match.puck
+        leftSide = mallet.defaultX < match.w//2
+        #Staying on our goal's side of the puck so hits send it forwards
+        behind = -puck.r if leftSide else puck.r
+        inOwnHalf = lambda x: (x < match.w//2) == leftSide
+        if not puck.lastTouched:
+            return puck.x + behind, puck.y
+        #Intercepting the puck where we can reach it in time
+        elapsed = self.frame - self.startFrame
+        for i, (x, y) in enumerate(self.path[elapsed:], 1):
+            if not inOwnHalf(x):
+                continue
+            ticks = math.hypot(x + behind - mallet.x, y - mallet.y)/(mallet.vel*math.sqrt(2))
+            if ticks <= i:
+                return x + behind + self.offset[0], y + self.offset[1]
+        #Otherwise guarding the goal in line with the puck
+        guardY = min(max(puck.y, GOAL_TOP), GOAL_BOTTOM)
+        return mallet.defaultX, guardY + self.offset[1]
+
+    def getInput(self, match, mallet):
+        ''' Returns the input bitmask for this tick '''
+        deadline = time.perf_counter() + self.budget
+        self.frame += 1
+        puck = match.puck
+        if self.isStale(puck) and self.frame - self.startFrame > self.reaction:
+            self.startPrediction(puck)
+        if self.ghost:
+            self.extendPrediction(deadline)
+        x, y = self.chooseTarget(match, mallet)
+        deadzone = mallet.vel/2
+        inputs = 0
+        if y < mallet.y - deadzone:
+            inputs |= UP
+        elif y > mallet.y + deadzone:
+            inputs |= DOWN
+        if x < mallet.x - deadzone:
+            inputs |= LEFT
+        elif x > mallet.x + deadzone:
+            inputs |= RIGHT
+        return inputs
@@ -0,0 +1,168 @@
+'''
+This module defines the game asset loading.
+Images can be prefetched, decoding them on a thread pool while a
+loading screen runs, and are converted on the main thread when first used.
+Includes:
+    1. Resource paths
+    2. Asset manager
+'''
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+
+def resourcePath(relativePath='', subdir='', path=False):
+    ''' Returns absolute path of project resource '''
+    try:
+        basePath = sys._MEIPASS
+    except AttributeError:
+        if relativePath.endswith('.txt'):
+            folder = 'Text files'
+        else:
+            folder = 'Images'
+        basePath = os.path.abspath(folder)
+        basePath = os.path.join(basePath, subdir)
+    if path:
+        return basePath
+    return os.path.join(basePath, relativePath)
+
+def surfaceSize(surface):
+    ''' Returns the number of bytes of pixel data in a surface '''
+    return surface.get_width()*surface.get_height()*surface.get_bytesize()
+
+class AssetManager:
+    ''' Class that loads game images once and hands out shared references '''
+    def __init__(self, budget=64*1024*1024, workers=None):
+        self.budget = budget
+        self.assets = OrderedDict()
+        self.sizes = {}
+        self.usedBytes = 0
+        self.hits = self.loads = self.evictions = 0
+        self.workers = workers
+        self.executor = None
+        #Decodes still running or not yet used, by folder and prefix
+        self.pending = {}
+
+    def convert(self, surface):
+        ''' Converts a surface to the display's pixel format '''
+        if not pygame.display.get_surface():
+            return surface
+        if surface.get_flags() & pygame.SRCALPHA:
+            return surface.convert_alpha()
+        return surface.convert()
+
+    def load(self, relativePath, subdir=''):
+        ''' Loads and converts a single image '''
+        self.loads += 1
+        return self.convert(pygame.image.load(resourcePath(relativePath, subdir=subdir)))
+
+    def prefetch(self, subdir, prefix):
+        ''' Starts decoding the frames in subdir whose names start with prefix on the thread pool '''
+        if (subdir, prefix) in self.pending:
+            return
+        if self.executor is None:
+            #Decoding a PNG releases the GIL, so the threads run in parallel
+            self.executor = ThreadPoolExecutor(self.workers or min(8, os.cpu_count() or 1))
+        base = resourcePath(path=True, subdir=subdir)
+        self.pending[(subdir, prefix)] = [
+            self.executor.submit(pygame.image.load, os.path.join(base, img))
+            for img in sorted(os.listdir(base)) if img.startswith(prefix)
+            ]
+
+    def progress(self):
+        ''' Returns the fraction of prefetched images decoded so far '''
+        futures = [future for futures in self.pending.values() for future in futures]
+        if not futures:
+            return 1
+        return sum(future.done() for future in futures)/len(futures)
+
+    def decodeFrames(self, subdir, prefix):
+        ''' Returns the decoded frames, taking them from a prefetch when there is one '''
+        futures = self.pending.pop((subdir, prefix), None)
+        if futures is None:
+            base = resourcePath(path=True, subdir=subdir)
+            return [
+                self.load(img, subdir)
+                for img in sorted(os.listdir(base)) if img.startswith(prefix)
+                ]
+        self.loads += len(futures)
+        #Converting needs the display, so it stays on the main thread
+        return [self.convert(future.result()) for future in futures]
+
+    def packSheet(self, frames):
+        ''' Packs frames side by side into one sprite sheet, returns the frame views '''
+        w = sum(frame.get_width() for frame in frames)
+        h = max(frame.get_height() for frame in frames)
+        sheet = self.convert(pygame.Surface((w, h), pygame.SRCALPHA))
+        x = 0
+        views = []
+        for frame in frames:
+            rect = sheet.blit(frame, (x, 0))
+            views.append(sheet.subsurface(rect))
+            x += rect.w
+        return sheet, views
+
+    def store(self, key, value, size):
+        ''' Caches an asset and evicts the least recently used ones over budget '''
+        self.assets[key] = value
+        self.sizes[key] = size
+        self.usedBytes += size
+        while self.usedBytes > self.budget and len(self.assets) > 1:
+            oldKey, _ = self.assets.popitem(last=False)
+            self.usedBytes -= self.sizes.pop(oldKey)
+            self.evictions += 1
+        return value
+
+    def fetch(self, key):
+        ''' Returns a cached asset, or None if it is not loaded '''
+        value = self.assets.get(key)
+        if value is not None:
+            self.hits += 1
+            self.assets.move_to_end(key)
+        return value
+
+    def getImage(self, relativePath, subdir=''):
+        ''' Returns a shared, display-converted image '''
+        key = ('image', subdir, relativePath)
+        image = self.fetch(key)
+        if image is None:
+            image = self.load(relativePath, subdir)
+            self.store(key, image, surfaceSize(image))
+        return image
+
+    def getFrames(self, subdir, prefix, sheet=False):
+        ''' Returns the shared animation frames in subdir whose names start with prefix '''
+        key = ('frames', subdir, prefix, sheet)
+        frames = self.fetch(key)
+        if frames is not None:
+            return frames
+        frames = self.decodeFrames(subdir, prefix)
+        if sheet:
+            sheetSurface, frames = self.packSheet(frames)
+            size = surfaceSize(sheetSurface)
+        else:
+            size = sum(surfaceSize(frame) for frame in frames)
+        return self.store(key, frames, size)
+
+    def stats(self):
+        ''' Returns the asset counters '''
+        return {
+            'assets': len(self.assets),
+            'bytes': self.usedBytes,
+            'budget': self.budget,
+            'hits': self.hits,
+            'loads': self.loads,
+            'evictions': self.evictions
+            }
+
+    def report(self):
+        ''' Returns the asset counters as a printable line '''
+        s = self.stats()
+        return (
+            f'Assets: {s["assets"]} cached, {s["bytes"]/2**20:.1f} of {s["budget"]/2**20:.0f} MB, '
+            f'{s["hits"]} hits, {s["loads"]} loads, {s["evictions"]} evictions'
+            )
+
+#Asset manager shared by all screens
+assets = AssetManager()
@@ -0,0 +1,170 @@
+'''
+This module defines a batched version of the game physics.
+It steps many headless matches at once as NumPy arrays, following the
+same rules as the Mallet, Puck and Match classes in physics.
+Includes:
+    1. MatchBatch
+'''
+import numpy as np
+from physics import (
+    TICK, UP, DOWN, LEFT, RIGHT, WIDTH, HEIGHT, GOAL_TOP, GOAL_BOTTOM,
+    SERVE_DIRECTIONS, parseTime
+    )
+
+#Values of lastTouched for a puck nobody has touched and for a served puck
+UNTOUCHED, SERVED = -1, 2
+
+class MatchBatch:
+    ''' Class that runs many one-on-one matches as NumPy arrays '''
+    def __init__(self, n, w=WIDTH, h=HEIGHT, seed=None, **kwargs):
+        self.n = n
+        self.w, self.h = w, h
+        self.rng = np.random.default_rng(seed)
+        self.scoreToWin = kwargs.get('scoreToWin', 7)
+        self.endTime = kwargs.get('endTime', '01:00')
+        self.endTicks = round(parseTime(self.endTime)/TICK)
+        #Sizes and speeds, as set by the Mallet and Puck classes
+        self.puckR = 20
+        self.malletR = 35
+        self.malletVel = 10
+        self.defaultVel = 10
+        self.incrementVel = 0.5
+        self.xLimits = ((0, w//2), (w//2, w))
+        self.defaultMalletX = np.array([75, w-75], dtype=float)
+        self.defaultMalletY = h//2-10
+        self.serveDirections = np.array(SERVE_DIRECTIONS)
+        self.reset()
+
+    def reset(self):
+        ''' Puts every match back to kick-off '''
+        n = self.n
+        self.x = np.full(n, self.w//2, dtype=float)
+        self.y = np.full(n, self.h//2, dtype=float)
+        #Speeds, and the velocity vectors they are the lengths of
+        self.vel = np.full(n, self.defaultVel, dtype=float)
+        self.vx, self.vy = self.serve(n)
+        self.lastTouched = np.full(n, UNTOUCHED, dtype=np.int8)
+        self.scored = np.zeros(n, dtype=bool)
+        self.malletX = np.tile(self.defaultMalletX, (n, 1))
+        self.malletY = np.full((n, 2), self.defaultMalletY, dtype=float)
+        self.scores = np.zeros((n, 2), dtype=np.int32)
+        self.ticks = np.zeros(n, dtype=np.int64)
+        self.accumulator = 0
+
+    def serve(self, n):
+        ''' Returns the velocity components of n freshly served pucks '''
+        directions = self.serveDirections[self.rng.integers(0, len(SERVE_DIRECTIONS), n)]
+        return directions[:, 0]*self.defaultVel, directions[:, 1]*self.defaultVel
+
+    @property
+    def timeUp(self):
+        return self.ticks >= self.endTicks
+
+    @property
+    def over(self):
+        return self.timeUp | (self.scores.max(axis=1) >= self.scoreToWin)
+
+    def getWinners(self):
+        ''' Returns the index of each match winner, or -1 for a draw '''
+        winners = np.argmax(self.scores, axis=1)
+        winners[self.scores[:, 0] == self.scores[:, 1]] = -1
+        return winners
+
+    def moveMallets(self, inputs, active):
+        ''' Moves every mallet according to its input bitmask '''
+        r, vel = self.malletR, self.malletVel
+        for i, (xMin, xMax) in enumerate(self.xLimits):
+            mask = inputs[:, i]
+            x, y = self.malletX[:, i], self.malletY[:, i]
+            y -= vel*(active & (mask & UP > 0) & (y >= vel+r))
+            y += vel*(active & (mask & DOWN > 0) & (y <= self.h-vel-r))
+            x -= vel*(active & (mask & LEFT > 0) & (x >= xMin+vel+r+5))
+            x += vel*(active & (mask & RIGHT > 0) & (x <= xMax-vel-r-5))
+
+    def movePucks(self, sel):
+        ''' Bounces and moves the selected pucks '''
+        x, y = self.x, self.y
+        pad = self.puckR + self.vel
+        #Boundary collisions are checked in the same order as Puck.isCollided
+        left = sel & (x - pad <= 0)
+        right = sel & ~left & (x + pad >= self.w)
+        down = sel & ~(left | right) & (y + pad >= self.h)
+        up = sel & ~(left | right | down) & (y - pad <= 0)
+        flip = up | down
+        self.vy[flip] = -self.vy[flip]
+        y[up] = pad[up]
+        y[down] = self.h - pad[down]
+        side = left | right
+        goal = side & (y - self.puckR >= GOAL_TOP) & (y + self.puckR <= GOAL_BOTTOM)
+        self.scored |= goal
+        side &= ~goal
+        self.vx[side] = -self.vx[side]
+        left &= side
+        right &= side
+        x[left] = pad[left]
+        x[right] = self.w - pad[right]
+        moving = sel & (self.lastTouched != UNTOUCHED)
+        x[moving] += self.vx[moving]
+        y[moving] += self.vy[moving]
+
+    def checkCollisions(self, sel):
+        ''' Bounces the selected pucks off the mallets they hit '''
+        for i in range(2):
+            sel = sel & ~self.scored
+            dx = self.x - self.malletX[:, i]
+            dy = self.y - self.malletY[:, i]
+            reach = self.malletR + self.puckR + self.vel
+            #Square roots are only taken for the pucks in reach
+            hit = sel & (dx*dx + dy*dy <= reach*reach)
+            if not hit.any():
+                continue
+            dx, dy, reach = dx[hit], dy[hit], reach[hit]
+            dist = np.sqrt(dx*dx + dy*dy) - reach
+            #Sending the puck along the contact normal, straight right if dead above or below
+            dx[dx == 0] = 1
+            d = np.sqrt(dx*dx + dy*dy)
+            nx, ny = dx/d, dy/d
+            self.vel[hit & (self.lastTouched != i)] += self.incrementVel
+            self.lastTouched[hit] = i
+            self.vx[hit] = self.vel[hit]*nx
+            self.vy[hit] = self.vel[hit]*ny
+            self.x[hit] -= dist*nx
+            self.y[hit] -= dist*ny
+            self.movePucks(hit)
+
+    def goal(self, scored):
+        ''' Adds up the scores of the scoring sides and serves new pucks '''
+        leftSide = self.x < self.w//2
+        self.scores[scored & leftSide, 1] += 1
+        self.scores[scored & ~leftSide, 0] += 1
+        self.malletX[scored] = self.defaultMalletX
+        self.malletY[scored] = self.defaultMalletY
+        self.x[scored] = self.w//2
+        self.y[scored] = self.h//2
+        self.vel[scored] = self.defaultVel
+        self.vx[scored], self.vy[scored] = self.serve(scored.sum())
+        self.lastTouched[scored] = SERVED
+        self.scored[scored] = False
+
+    def tick(self, inputs=None):
+        ''' Advances every match by one physics tick, returns the goal mask '''
+        if inputs is None:
+            inputs = np.zeros((self.n, 2), dtype=np.uint8)
+        active = ~self.over
+        self.moveMallets(inputs, active)
+        self.movePucks(active)
+        self.checkCollisions(active)
+        scored = self.scored.copy()
+        if scored.any():
+            self.goal(scored)
+        self.ticks += active & ~scored
+        return scored
+
+    def step(self, dt, inputs=None):
+        ''' Advances every match by dt seconds of fixed ticks, returns goals per match '''
+        self.accumulator += dt
+        goals = np.zeros(self.n, dtype=np.int32)
+        while self.accumulator >= TICK:
+            self.accumulator -= TICK
+            goals += self.tick(inputs)
+        return goals
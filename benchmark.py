@@ -0,0 +1,283 @@
+'''
+This module benchmarks the game's hot paths headless.
+It runs with SDL's dummy video driver and writes its results as JSON.
+Golden trajectories catch optimizations that change gameplay.
+Usage:
+    python benchmark.py [--output FILE] [--compare FILE] [--update-golden] [--quick]
+'''
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import pygame
+import main as game
+from assets import assets
+from commandline import parseArgs
+from fonts import textCache
+from physics import Match
+from sprites import Player
+from spectator import SpectatorWall
+from widgets import Button
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_trajectories.json')
+#Seeds, input seeds and options of the golden matches
+GOLDEN_MATCHES = {
+    'default': {'seed': 1, 'inputSeed': 2, 'options': {}},
+    'swept': {'seed': 3, 'inputSeed': 4, 'options': {'swept': True}}
+    }
+GOLDEN_TICKS = 3600
+GOLDEN_EVERY = 60
+#Pixels the puck may stray from the goldens, which predate the velocity vector puck;
+#its last-bit rounding differences grow to about 0.15 px over the default match's rallies
+TOLERANCE = 0.25
+#Seeded matches and ticks stepped by both the scalar and the batch physics, which agree exactly
+BATCH_MATCHES = 100
+BATCH_TICKS = 1800
+BATCH_TOLERANCE = 1e-9
+
+def percentile(values, q):
+    ''' Returns the q-th percentile of values '''
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q/100*len(values)))]
+
+def timeCalls(func, n):
+    ''' Calls func n times, returns calls per second '''
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return n/(time.perf_counter() - start)
+
+def timeFrames(frame, n):
+    ''' Times n calls of a frame function, returns FPS and frame time percentiles in ms '''
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        frame()
+        times.append(time.perf_counter() - start)
+    return {
+        'fps': n/sum(times),
+        'p50': percentile(times, 50)*1000,
+        'p99': percentile(times, 99)*1000
+        }
+
+def randomInputs(seed):
+    ''' Returns a function giving random input bitmasks for both players '''
+    rng = random.Random(seed)
+    return lambda: (rng.randrange(16), rng.randrange(16))
+
+def benchPhysics(n):
+    ''' Measures physics ticks per second '''
+    results = {}
+    for name, options in (('tick', {}), ('sweptTick', {'swept': True})):
+        match = Match(seed=0, endTime='99:00', scoreToWin=10**6, **options)
+        inputs = randomInputs(0)
+        results[name] = timeCalls(lambda: match.tick(inputs()), n)
+    #Fifty pucks and two against two, the multi-puck frame budget target
+    match = Match(seed=0, endTime='99:00', scoreToWin=10**6, teamSize=2, puckCount=50)
+    rng = random.Random(0)
+    results['multiPuckTick'] = timeCalls(
+        lambda: match.tick([rng.randrange(16) for _ in range(4)]), max(n//100, 10)
+        )
+    match = Match(seed=0)
+    match.puck.lastTouched = True
+    results['puckMove'] = timeCalls(match.puck.move, n)
+    mallet = match.mallets[0]
+    results['checkCollision'] = timeCalls(lambda: mallet.checkCollision(match.puck), n)
+    try:
+        import numpy
+        from batch import MatchBatch
+    except ImportError:
+        return results
+    batch = MatchBatch(10000, seed=0, endTime='99:00', scoreToWin=10**6)
+    inputs = numpy.random.default_rng(0).integers(0, 16, (batch.n, 2), dtype=numpy.uint8)
+    ticks = max(n//1000, 10)
+    results['batchMatchTicks'] = timeCalls(lambda: batch.tick(inputs), ticks)*batch.n
+    return results
+
+def benchDrawing(window, n):
+    ''' Measures calls per second of the drawing hot paths '''
+    screen = game.ControlScreen(window)
+    player = Player(75, 250, 35, game.RED, (0, 500), (0, 500), controls='WSAD')
+    button = Button(window, (500, 400), 'Pause', pad=5)
+    return {
+        'drawHockeyGround': timeCalls(screen.drawHockeyGround, n),
+        'playerUpdate': timeCalls(lambda: player.update(window), n),
+        'buttonDraw': timeCalls(button.draw, n)
+        }
+
+def benchScreens(window, n):
+    ''' Measures frame times of every screen class '''
+    names = ['Red', 'Blue']
+    winners = pygame.sprite.Group(
+        Player(400, 250, 35, game.RED, name=names[0]),
+        Player(600, 250, 35, game.BLUE, name=names[1])
+        )
+    screens = {
+        'StartScreen': game.StartScreen(window),
+        'ControlScreen': game.ControlScreen(window),
+        'PauseScreen': game.PauseScreen(window, 7, '03:00'),
+        'EndScreen': game.EndScreen(window, winners, draw=True),
+        'Game': game.Game(window, names, endTime='99:00', seed=0),
+        'MultiPuckGame': game.Game(
+            window, names, endTime='99:00', seed=0, teamSize=2, puckCount=50
+            ),
+        'SpectatorWall': SpectatorWall(window, 16)
+        }
+    inputs = randomInputs(0)
+    results = {}
+    for name, screen in screens.items():
+        if isinstance(screen, game.Game):
+            screen.readInputs = lambda: inputs()*2
+            frame = lambda screen=screen: (
+                screen.updateGame(), screen.scheduler.update(1/60), screen.redrawGame()
+                )
+        else:
+            frame = lambda screen=screen: (screen.update(1/60), screen.redrawGame())
+        results[name] = timeFrames(frame, n)
+    return results
+
+def benchColdStart(runs):
+    ''' Starts the game in fresh processes, returns the median startup times in ms '''
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, main, '--startup'], capture_output=True, text=True,
+            cwd=os.path.dirname(main), check=True
+            ).stdout
+        times.append(json.loads(output.splitlines()[-1]))
+    #The first run resolves the fonts, later ones read the persisted paths
+    return {key: percentile([t[key] for t in times], 50) for key in times[0]}
+
+def goldenTrajectory(seed, inputSeed, options):
+    ''' Plays a scripted match, returns puck positions and scores along the way '''
+    match = Match(seed=seed, endTime='99:00', scoreToWin=10**6, **options)
+    inputs = randomInputs(inputSeed)
+    #Serving straight away so the puck moves from the first tick
+    match.puck.lastTouched = True
+    points = []
+    for tick in range(GOLDEN_TICKS):
+        match.tick(inputs())
+        if tick % GOLDEN_EVERY == 0:
+            points.append([match.puck.x, match.puck.y])
+    return {'points': points, 'scores': [mallet.score for mallet in match.mallets]}
+
+def checkBatch(n=BATCH_MATCHES, ticks=BATCH_TICKS):
+    ''' Steps seeded matches and a MatchBatch on the same inputs, returns where they disagree '''
+    try:
+        import numpy
+        from batch import MatchBatch, SERVED
+    except ImportError:
+        return []
+    matches = [Match(seed=seed, endTime='99:00', scoreToWin=10**6) for seed in range(n)]
+    batch = MatchBatch(n, endTime='99:00', scoreToWin=10**6)
+    def copyServes(served):
+        #The batch draws serves from its own generator, so it takes the seeded matches' ones
+        for i in numpy.flatnonzero(served):
+            batch.vx[i], batch.vy[i] = matches[i].puck.vx, matches[i].puck.vy
+    copyServes(numpy.ones(n, dtype=bool))
+    #Serving straight away so the pucks move from the first tick
+    for match in matches:
+        match.puck.lastTouched = True
+    batch.lastTouched[:] = SERVED
+    rng = numpy.random.default_rng(0)
+    for tick in range(ticks):
+        inputs = rng.integers(0, 16, (n, 2), dtype=numpy.uint8)
+        for match, row in zip(matches, inputs.tolist()):
+            match.tick(row)
+        copyServes(batch.tick(inputs))
+        puck = numpy.array([[m.puck.x, m.puck.y] for m in matches])
+        mallets = numpy.array([
+            [value for mallet in m.mallets for value in (mallet.x, mallet.y)] for m in matches
+            ])
+        scores = numpy.array([[mallet.score for mallet in m.mallets] for m in matches])
+        checks = (
+            ('puck', numpy.abs(puck - numpy.stack([batch.x, batch.y], axis=1)) > BATCH_TOLERANCE),
+            ('mallets', numpy.abs(
+                mallets - numpy.stack([batch.malletX, batch.malletY], axis=2).reshape(n, -1)
+                ) > BATCH_TOLERANCE),
+            ('scores', scores != batch.scores)
+            )
+        for name, wrong in checks:
+            wrong = numpy.flatnonzero(wrong.any(axis=1))
+            if len(wrong):
+                return [f'batch: {name} of match {wrong[0]} differ from Match at tick {tick}']
+    return []
+
+def checkGolden(update=False):
+    ''' Compares golden trajectories with the stored ones and the batch with Match, returns the failures '''
+    trajectories = {
+        name: goldenTrajectory(**golden) for name, golden in GOLDEN_MATCHES.items()
+        }
+    failures = checkBatch()
+    if update or not os.path.exists(GOLDEN_PATH):
+        with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+            json.dump(trajectories, f, indent=1)
+        return failures
+    with open(GOLDEN_PATH, 'r', encoding='utf-8') as f:
+        stored = json.load(f)
+    for name, trajectory in trajectories.items():
+        expected = stored[name]
+        if trajectory['scores'] != expected['scores']:
+            failures.append(f'{name}: scores {trajectory["scores"]} != {expected["scores"]}')
+        for i, (point, old) in enumerate(zip(trajectory['points'], expected['points'])):
+            if max(abs(a - b) for a, b in zip(point, old)) > TOLERANCE:
+                failures.append(f'{name}: puck at tick {i*GOLDEN_EVERY} is {point}, not {old}')
+                break
+    return failures
+
+def compare(results, path):
+    ''' Prints the change of every rate and frame time against an earlier run '''
+    with open(path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    for section in ('physics', 'drawing', 'screens', 'coldStart'):
+        for name, value in results[section].items():
+            before = old.get(section, {}).get(name)
+            if before is None:
+                continue
+            if isinstance(value, dict):
+                value, before = value['p99'], before['p99']
+                label = f'{section}.{name}.p99'
+            else:
+                label = f'{section}.{name}'
+            print(f'{label}: {before:.4g} -> {value:.4g} ({(value/before - 1)*100:+.1f}%)')
+
+def main(args):
+    ''' Runs the benchmarks and golden trajectory checks '''
+    _, options = parseArgs(args, switches=('--quick', '--update-golden'))
+    quick = '--quick' in options
+    n = 2000 if quick else 20000
+    frames = 100 if quick else 600
+    window = game.createWindow()
+    failures = checkGolden('--update-golden' in options)
+    results = {
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'physics': benchPhysics(n),
+        'drawing': benchDrawing(window, n//10),
+        'screens': benchScreens(window, frames),
+        'coldStart': benchColdStart(3 if quick else 10),
+        #Counters of the shared caches after every screen has run
+        'caches': {'assets': assets.stats(), 'text': textCache.stats()},
+        'golden': failures or 'ok'
+        }
+    text = json.dumps(results, indent=1)
+    if '--output' in options:
+        with open(options['--output'], 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    if '--compare' in options:
+        compare(results, options['--compare'])
+    pygame.quit()
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,72 @@
+'''
+This module parses the command lines of the game and its tools.
+Options are --name value pairs, except the switches a tool names, which
+take no value, so an argument after a switch is still positional.
+Includes:
+    1. Argument parsing
+    2. Option values
+'''
+import sys
+
+def parseArgs(args, switches=()):
+    ''' Splits arguments into positional ones and options, switches mapping to True '''
+    positional = []
+    options = {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in switches:
+            options[arg] = True
+        elif arg.startswith('--'):
+            if i + 1 == len(args):
+                sys.exit(f'{arg} needs a value')
+            options[arg] = args[i + 1]
+            i += 1
+        else:
+            positional.append(arg)
+        i += 1
+    return positional, options
+
+def intOption(options, name, default):
+    ''' Returns an option as a whole number, exiting with a message when it is not one '''
+    value = options.get(name, default)
+    try:
+        return int(value)
+    except ValueError:
+        sys.exit(f'{name} takes a whole number, not {value}')
+
+def choiceOption(options, name, choices, default=None):
+    ''' Returns an option that must be one of choices, exiting with a message when it is not '''
+    value = options.get(name, default)
+    if value is not None and value not in choices:
+        sys.exit(f'{name} takes one of {"|".join(choices)}, not {value}')
+    return value
+
+def floatOption(options, name, default):
+    ''' Returns an option as a number, exiting with a message when it is not one '''
+    value = options.get(name, default)
+    try:
+        return float(value)
+    except ValueError:
+        sys.exit(f'{name} takes a number, not {value}')
+
+def addressOption(options, name):
+    ''' Returns a host:port option as a (host, port) tuple, exiting with a message when malformed '''
+    value = options.get(name)
+    if value is None:
+        return None
+    host, _, port = value.rpartition(':')
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        sys.exit(f'{name} takes an address like localhost:5555, not {value}')
+    return host, int(port)
+
+def sizeOption(options, name, default=None):
+    ''' Returns a WxH option as a (width, height) tuple, exiting with a message when malformed '''
+    value = options.get(name)
+    if value is None:
+        return default
+    try:
+        width, height = (int(val) for val in value.lower().split('x'))
+    except ValueError:
+        sys.exit(f'{name} takes a size like 1280x640, not {value}')
+    return width, height
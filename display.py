@@ -0,0 +1,86 @@
+'''
+This module defines the scaled render target.
+Screens draw in logical coordinates onto a canvas of the logical size,
+and the canvas is scaled into a window of any size when presented.
+Includes:
+    1. Display
+    2. Shared display
+'''
+import math
+import pygame
+from physics import WIDTH, HEIGHT
+
+class Display:
+    ''' Class that owns the window and the logical canvas drawn into it '''
+    def __init__(self, size=(WIDTH, HEIGHT)):
+        self.size = size
+        self.window = None
+        self.canvas = None
+        self.smooth = False
+
+    def open(self, windowSize=None, vsync=False, smooth=False):
+        ''' Opens the window, returns the canvas to draw on '''
+        windowSize = tuple(windowSize or self.size)
+        self.smooth = smooth
+        if vsync:
+            #SDL scales a SCALED window itself, and vsync needs its renderer
+            self.window = pygame.display.set_mode(self.size, pygame.SCALED, vsync=1)
+        elif windowSize == self.size:
+            self.window = pygame.display.set_mode(self.size)
+        else:
+            self.window = pygame.display.set_mode(windowSize, pygame.RESIZABLE)
+        if self.window.get_size() == self.size:
+            #Drawing straight into the window when no scaling is needed
+            self.canvas = self.window
+        else:
+            self.canvas = pygame.Surface(self.size).convert()
+        return self.canvas
+
+    @property
+    def scaled(self):
+        return self.canvas is not self.window
+
+    def windowScale(self):
+        ''' Returns the window pixels per logical pixel along each axis '''
+        w, h = pygame.display.get_surface().get_size()
+        return w/self.size[0], h/self.size[1]
+
+    def toLogical(self, pos):
+        ''' Converts a window position, such as a mouse position, to logical coordinates '''
+        if not self.scaled:
+            return pos
+        sx, sy = self.windowScale()
+        return int(pos[0]/sx), int(pos[1]/sy)
+
+    def mousePos(self):
+        return self.toLogical(pygame.mouse.get_pos())
+
+    def present(self, rects=None):
+        ''' Shows the canvas, or only the given logical rects of it, in the window '''
+        if not self.scaled:
+            if rects is None:
+                pygame.display.update()
+            else:
+                pygame.display.update(rects)
+            return
+        window = pygame.display.get_surface()
+        scale = pygame.transform.smoothscale if self.smooth else pygame.transform.scale
+        if rects is None:
+            scale(self.canvas, window.get_size(), window)
+            pygame.display.update()
+            return
+        sx, sy = self.windowScale()
+        canvasRect = self.canvas.get_rect()
+        updated = []
+        for rect in rects:
+            #Growing each rect by a pixel so neighbouring rects scale without seams
+            rect = pygame.Rect(rect).inflate(2, 2).clip(canvasRect)
+            if not rect.w or not rect.h:
+                continue
+            x, y = math.floor(rect.x*sx), math.floor(rect.y*sy)
+            w, h = math.ceil(rect.right*sx) - x, math.ceil(rect.bottom*sy) - y
+            updated.append(window.blit(scale(self.canvas.subsurface(rect), (w, h)), (x, y)))
+        pygame.display.update(updated)
+
+#Display shared by every screen
+display = Display()
@@ -0,0 +1,215 @@
+'''
+This module defines a reinforcement learning environment for the game.
+It follows the gym reset/step API on top of the headless Match, and can
+spread many environments over worker processes sharing their buffers.
+Includes:
+    1. Air hockey environment
+    2. Vectorized environment
+'''
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from ai import CPUController
+from physics import Match, LEFT, RIGHT
+
+#Observation layout, as seen from the agent's side of the rink
+OBS_FIELDS = (
+    'puckX', 'puckY', 'puckVX', 'puckVY',
+    'malletX', 'malletY', 'malletVX', 'malletVY',
+    'opponentX', 'opponentY', 'opponentVX', 'opponentVY',
+    'score', 'opponentScore', 'timeLeft'
+    )
+OBS_SIZE = len(OBS_FIELDS)
+#Actions are the input bitmasks of a mallet
+N_ACTIONS = 16
+
+def mirrorAction(action):
+    ''' Swaps the left and right flags of an input bitmask '''
+    return action & ~(LEFT | RIGHT) | (LEFT if action & RIGHT else 0) | (RIGHT if action & LEFT else 0)
+
+class AirHockeyEnv:
+    ''' Class that exposes one mallet of a match through reset and step '''
+    def __init__(self, side=0, opponent='medium', seed=None, **kwargs):
+        #The right hand side is mirrored, so one policy can play either side
+        self.side = side
+        self.opponentSpec = opponent
+        self.seed = seed
+        self.kwargs = kwargs
+        self.match = None
+        self.opponent = None
+        self.episodes = 0
+
+    def createOpponent(self, seed):
+        ''' Returns the controller of the other mallet, or None to leave it idle '''
+        if isinstance(self.opponentSpec, str):
+            return CPUController(self.opponentSpec, seed)
+        return self.opponentSpec
+
+    def reset(self, seed=None):
+        ''' Starts a new match, returns the first observation and info '''
+        if seed is None and self.seed is not None:
+            seed = self.seed + self.episodes
+        self.episodes += 1
+        self.match = Match(seed=seed, **self.kwargs)
+        self.opponent = self.createOpponent(self.match.seed)
+        self.previous = [(mallet.x, mallet.y) for mallet in self.match.mallets]
+        obs = np.empty(OBS_SIZE, dtype=np.float32)
+        self.observe(obs)
+        return obs, {'seed': self.match.seed}
+
+    def step(self, action):
+        ''' Plays one tick with the agent's input bitmask, returns obs, reward, terminated, truncated, info '''
+        match = self.match
+        agent, other = match.mallets[self.side], match.mallets[1 - self.side]
+        if self.side:
+            action = mirrorAction(action)
+        inputs = [0, 0]
+        inputs[self.side] = action
+        if self.opponent:
+            inputs[1 - self.side] = self.opponent.getInput(match, other)
+        self.previous = [(mallet.x, mallet.y) for mallet in match.mallets]
+        scores = agent.score, other.score
+        goal = match.tick(inputs)
+        #Rewarding goals as counted by Match.goal
+        reward = float((agent.score - scores[0]) - (other.score - scores[1]))
+        obs = np.empty(OBS_SIZE, dtype=np.float32)
+        self.observe(obs)
+        info = {'goal': goal, 'ticks': match.ticks}
+        if match.over:
+            winner = match.getWinner()
+            info['winner'] = None if winner is None else int(winner is other)
+        return obs, reward, match.over, False, info
+
+    def observe(self, out):
+        ''' Writes the observation of the current state into out '''
+        match = self.match
+        puck = match.puck
+        moving = bool(puck.lastTouched)
+        puckVX, puckVY = puck.vx*moving, puck.vy*moving
+        agent, other = match.mallets[self.side], match.mallets[1 - self.side]
+        (ax, ay), (ox, oy) = self.previous[self.side], self.previous[1 - self.side]
+        values = [
+            puck.x, puck.y, puckVX, puckVY,
+            agent.x, agent.y, agent.x - ax, agent.y - ay,
+            other.x, other.y, other.x - ox, other.y - oy,
+            agent.score, other.score, match.endSeconds - match.time
+            ]
+        if self.side:
+            for i in (0, 4, 8):
+                values[i] = match.w - values[i]
+            for i in (2, 6, 10):
+                values[i] = -values[i]
+        out[:] = values
+
+def worker(conn, names, start, stop, n, seed, kwargs):
+    ''' Runs environments start to stop of a vectorized environment in a process '''
+    buffers = [shared_memory.SharedMemory(name=name) for name in names]
+    obs = np.ndarray((n, OBS_SIZE), dtype=np.float32, buffer=buffers[0].buf)
+    rewards = np.ndarray(n, dtype=np.float32, buffer=buffers[1].buf)
+    dones = np.ndarray(n, dtype=bool, buffer=buffers[2].buf)
+    actions = np.ndarray(n, dtype=np.uint8, buffer=buffers[3].buf)
+    envs = [
+        AirHockeyEnv(seed=None if seed is None else seed + i*10**6, **kwargs)
+        for i in range(start, stop)
+        ]
+    try:
+        while True:
+            command = conn.recv()
+            if command == 'close':
+                break
+            infos = []
+            for i, env in enumerate(envs, start):
+                if command == 'reset':
+                    _, info = env.reset()
+                    rewards[i], dones[i] = 0, False
+                else:
+                    _, rewards[i], dones[i], _, info = env.step(int(actions[i]))
+                    #Resetting finished matches straight away, as gym vector environments do
+                    if dones[i]:
+                        info['final'] = env.match.ticks
+                        env.reset()
+                env.observe(obs[i])
+                infos.append(info)
+            conn.send(infos)
+    finally:
+        del obs, rewards, dones, actions
+        for buffer in buffers:
+            buffer.close()
+        conn.close()
+
+class VectorEnv:
+    ''' Class that steps many environments over a pool of worker processes '''
+    def __init__(self, n, workers=None, seed=None, **kwargs):
+        self.n = n
+        self.workers = min(workers or mp.cpu_count(), n)
+        #Observations, rewards, done flags and actions live in shared memory,
+        #so only the commands and infos go through the pipes
+        layout = (
+            (n*OBS_SIZE*4, np.float32, (n, OBS_SIZE)),
+            (n*4, np.float32, n),
+            (n, bool, n),
+            (n, np.uint8, n)
+            )
+        self.buffers = [shared_memory.SharedMemory(create=True, size=size) for size, _, _ in layout]
+        self.obs, self.rewards, self.dones, self.actions = [
+            np.ndarray(shape, dtype=dtype, buffer=buffer.buf)
+            for (_, dtype, shape), buffer in zip(layout, self.buffers)
+            ]
+        names = [buffer.name for buffer in self.buffers]
+        self.conns = []
+        self.processes = []
+        for k in range(self.workers):
+            start, stop = n*k//self.workers, n*(k + 1)//self.workers
+            parent, child = mp.Pipe()
+            process = mp.Process(
+                target=worker, args=(child, names, start, stop, n, seed, kwargs), daemon=True
+                )
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+        self.closed = False
+
+    def command(self, command):
+        ''' Sends a command to every worker, returns the infos of all environments '''
+        for conn in self.conns:
+            conn.send(command)
+        infos = []
+        for conn in self.conns:
+            infos.extend(conn.recv())
+        return infos
+
+    def reset(self):
+        ''' Starts new matches everywhere, returns the observations and infos '''
+        infos = self.command('reset')
+        return self.obs.copy(), infos
+
+    def step(self, actions):
+        ''' Steps every environment, returns obs, rewards, terminated, truncated and infos '''
+        self.actions[:] = actions
+        infos = self.command('step')
+        return (
+            self.obs.copy(), self.rewards.copy(), self.dones.copy(),
+            np.zeros(self.n, dtype=bool), infos
+            )
+
+    def close(self):
+        ''' Stops the workers and frees the shared memory '''
+        if self.closed:
+            return
+        self.closed = True
+        for conn in self.conns:
+            conn.send('close')
+        for process in self.processes:
+            process.join()
+        del self.obs, self.rewards, self.dones, self.actions
+        for buffer in self.buffers:
+            buffer.close()
+            buffer.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
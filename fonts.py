@@ -0,0 +1,119 @@
+'''
+This module defines the font and text caches shared by every screen.
+Font names are resolved to files once and the paths are kept on disk,
+so later starts skip the system font scan.
+Includes:
+    1. Font path cache
+    2. Text cache
+    3. Shared cache helpers
+'''
+import json
+import os
+from collections import OrderedDict
+import pygame
+
+def fontCachePath():
+    ''' Returns the file the resolved font paths are kept in '''
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'air-hockey', 'fonts.json')
+
+class FontPaths:
+    ''' Class that maps font names to font files, persisted between runs '''
+    def __init__(self, path=None):
+        self.path = path or fontCachePath()
+        self.paths = None
+        self.scans = 0
+
+    def load(self):
+        ''' Reads the paths resolved by earlier runs '''
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.paths = json.load(f)
+        except (OSError, ValueError):
+            self.paths = {}
+
+    def save(self):
+        ''' Writes the resolved paths, ignoring a cache directory that cannot be written '''
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.paths, f, indent=1)
+        except OSError:
+            pass
+
+    def resolve(self, family):
+        ''' Returns the file of a font name, or None for pygame's default font '''
+        if self.paths is None:
+            self.load()
+        #Missing fonts are kept as None too, so they do not trigger a scan every run
+        if family in self.paths:
+            path = self.paths[family]
+            if path is None or os.path.exists(path):
+                return path
+        self.scans += 1
+        path = self.paths[family] = pygame.font.match_font(family)
+        self.save()
+        return path
+
+class TextCache:
+    ''' Class that resolves fonts once and keeps rendered text in an LRU cache '''
+    def __init__(self, maxSize=256):
+        self.fontPaths = FontPaths()
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+        self.maxSize = maxSize
+        self.hits = self.misses = self.evictions = 0
+
+    def getFont(self, family, size):
+        ''' Returns the font for a (family, size), loading it only once '''
+        key = (family, size)
+        if key not in self.fonts:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            self.fonts[key] = pygame.font.Font(self.fontPaths.resolve(family), size)
+        return self.fonts[key]
+
+    def render(self, font, text, colour, antialias=1):
+        ''' Returns the rendered text surface, rendering it only on a miss '''
+        key = (font, text, tuple(colour), bool(antialias))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = self.surfaces[key] = font.render(text, antialias, colour)
+        if len(self.surfaces) > self.maxSize:
+            self.surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def clear(self):
+        ''' Empties the text cache '''
+        self.surfaces.clear()
+
+    def stats(self):
+        ''' Returns the cache counters '''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.surfaces),
+            'fonts': len(self.fonts),
+            'fontScans': self.fontPaths.scans
+            }
+
+    def report(self):
+        ''' Returns the cache counters as a printable line '''
+        s = self.stats()
+        lookups = s['hits'] + s['misses']
+        return (
+            f'Text cache: {s["hits"]} hits, {s["misses"]} misses '
+            f'({s["hits"]/lookups if lookups else 0:.0%} hit rate), {s["evictions"]} evictions, '
+            f'{s["size"]} surfaces, {s["fonts"]} fonts, {s["fontScans"]} font scans'
+            )
+
+#Cache shared by all screens and widgets
+textCache = TextCache()
+getFont = textCache.getFont
+renderText = textCache.render
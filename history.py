@@ -0,0 +1,238 @@
+'''
+This module keeps the match history and leaderboard in SQLite.
+Every write and query runs on a background thread behind a queue, and
+query results land in a cache, so screens read the last results without
+ever waiting on the disk during a frame.
+Includes:
+    1. Schema and queries
+    2. Match history with write-behind
+    3. Shared match history
+Usage:
+    python history.py [PLAYER PLAYER] [--top N] [--recent N] [--db FILE]
+'''
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from commandline import parseArgs
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    played REAL NOT NULL,
+    leftName TEXT NOT NULL,
+    rightName TEXT NOT NULL,
+    leftScore INTEGER NOT NULL,
+    rightScore INTEGER NOT NULL,
+    winner INTEGER,
+    ticks INTEGER,
+    seed INTEGER
+    );
+CREATE INDEX IF NOT EXISTS matchesPlayed ON matches (played DESC);
+CREATE INDEX IF NOT EXISTS matchesPair ON matches (leftName, rightName);
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    played INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    goalsFor INTEGER NOT NULL DEFAULT 0,
+    goalsAgainst INTEGER NOT NULL DEFAULT 0
+    );
+CREATE INDEX IF NOT EXISTS playersRank ON players (wins DESC, (goalsFor - goalsAgainst) DESC);
+'''
+
+def historyPath():
+    ''' Returns the file the match history is kept in '''
+    base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'air-hockey', 'history.sqlite3')
+
+def connect(path):
+    ''' Opens the history database, creating its tables and indexes '''
+    if path != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+def addMatch(conn, names, scores, winner, ticks=None, seed=None, played=None):
+    ''' Inserts a match and adds it to both players' records '''
+    conn.execute(
+        'INSERT INTO matches (played, leftName, rightName, leftScore, rightScore, winner, ticks, seed)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (played or time.time(), names[0], names[1], scores[0], scores[1], winner, ticks, seed)
+        )
+    for side in (0, 1):
+        result = 'draws' if winner is None else ('wins' if winner == side else 'losses')
+        conn.execute(
+            'INSERT INTO players (name) VALUES (?) ON CONFLICT (name) DO NOTHING', (names[side],)
+            )
+        conn.execute(
+            f'UPDATE players SET played = played + 1, {result} = {result} + 1,'
+            ' goalsFor = goalsFor + ?, goalsAgainst = goalsAgainst + ? WHERE name = ?',
+            (scores[side], scores[1 - side], names[side])
+            )
+
+def topPlayers(conn, n=5):
+    ''' Returns (name, wins, draws, losses, goal difference) of the n best players '''
+    return conn.execute(
+        'SELECT name, wins, draws, losses, goalsFor - goalsAgainst FROM players'
+        ' ORDER BY wins DESC, (goalsFor - goalsAgainst) DESC LIMIT ?', (n,)
+        ).fetchall()
+
+def headToHead(conn, a, b):
+    ''' Returns the wins of a, the wins of b and the draws between them '''
+    wins = [0, 0, 0]
+    rows = conn.execute(
+        'SELECT leftName, winner FROM matches WHERE leftName = ? AND rightName = ?'
+        ' UNION ALL SELECT leftName, winner FROM matches WHERE leftName = ? AND rightName = ?',
+        (a, b, b, a)
+        )
+    for left, winner in rows:
+        if winner is None:
+            wins[2] += 1
+        else:
+            #Counting the winner from a's side of the pairing
+            wins[(winner == 0) != (left == a)] += 1
+    return tuple(wins)
+
+def recentMatches(conn, n=5):
+    ''' Returns (left name, right name, left score, right score) of the n latest matches '''
+    return conn.execute(
+        'SELECT leftName, rightName, leftScore, rightScore FROM matches'
+        ' ORDER BY played DESC LIMIT ?', (n,)
+        ).fetchall()
+
+class MatchHistory:
+    ''' Class that writes matches and runs queries on a background thread, caching the results '''
+    def __init__(self, path=None, top=5, recent=5):
+        self.path = path or historyPath()
+        self.top = top
+        self.recent = recent
+        self.jobs = queue.Queue()
+        self.thread = None
+        #Query results by key, replaced whole by the worker so readers never see them half built
+        self.cache = {}
+        self.pairs = set()
+
+    @property
+    def opened(self):
+        return self.thread is not None
+
+    def open(self, path=None):
+        ''' Starts the background thread and the first queries '''
+        if self.opened:
+            return
+        self.path = path or self.path
+        self.thread = threading.Thread(target=self.work, name='history', daemon=True)
+        self.thread.start()
+        self.refresh()
+
+    def close(self):
+        ''' Finishes the queued writes and stops the background thread '''
+        if not self.opened:
+            return
+        self.jobs.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def work(self):
+        ''' Runs queued jobs, several at a time in one transaction '''
+        try:
+            conn = connect(self.path)
+        except (sqlite3.Error, OSError) as e:
+            print(f'Match history is off: {e}', file=sys.stderr)
+            #Still draining the queue, so writers never block
+            while self.jobs.get() is not None:
+                pass
+            return
+        running = True
+        while running:
+            jobs = [self.jobs.get()]
+            #Taking whatever else is waiting, so a burst of writes costs one commit
+            while True:
+                try:
+                    jobs.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if None in jobs:
+                running = False
+                jobs = jobs[:jobs.index(None)]
+            try:
+                with conn:
+                    for job in jobs:
+                        job(conn)
+            except sqlite3.Error as e:
+                print(f'Match history error: {e}', file=sys.stderr)
+        conn.close()
+
+    def submit(self, job):
+        ''' Queues a job taking the connection, doing nothing while the history is closed '''
+        if self.opened:
+            self.jobs.put(job)
+
+    def store(self, key, value):
+        self.cache = {**self.cache, key: value}
+
+    def query(self, key, func, *args):
+        ''' Queues a query whose result is cached under key '''
+        self.submit(lambda conn: self.store(key, func(conn, *args)))
+
+    def refresh(self):
+        ''' Queues the leaderboard, recent matches and watched head-to-head queries '''
+        self.query('leaderboard', topPlayers, self.top)
+        self.query('recent', recentMatches, self.recent)
+        for a, b in self.pairs:
+            self.query(('headToHead', a, b), headToHead, a, b)
+
+    def watch(self, a, b):
+        ''' Keeps the head-to-head record of two players in the cache '''
+        if (a, b) not in self.pairs:
+            self.pairs.add((a, b))
+            self.query(('headToHead', a, b), headToHead, a, b)
+
+    def recordMatch(self, names, scores, winner, ticks=None, seed=None):
+        ''' Queues a finished match, then fresh queries including it '''
+        played = time.time()
+        self.submit(lambda conn: addMatch(conn, names, scores, winner, ticks, seed, played))
+        self.refresh()
+
+    def get(self, key, default=None):
+        ''' Returns the last cached result of a query, never touching the database '''
+        return self.cache.get(key, default)
+
+    def leaderboardLines(self):
+        ''' Returns the cached leaderboard as text lines '''
+        return [
+            f'{i}. {name}  {wins}W {draws}D {losses}L'
+            for i, (name, wins, draws, losses, _) in enumerate(self.get('leaderboard', []), 1)
+            ]
+
+    def recentLines(self):
+        ''' Returns the cached recent matches as text lines '''
+        return [f'{a} {sa} - {sb} {b}' for a, b, sa, sb in self.get('recent', [])]
+
+#Match history shared by every screen, opened by the game
+history = MatchHistory()
+
+def main(args):
+    ''' Prints the leaderboard and recent matches, or the head-to-head of two players '''
+    names, options = parseArgs(args)
+    conn = connect(options.get('--db', historyPath()))
+    if len(names) == 2:
+        a, b = names
+        wins = headToHead(conn, a, b)
+        print(f'{a} {wins[0]} - {wins[1]} {b}, {wins[2]} draws')
+        return
+    print(f'{"Player":<20}{"W":>5}{"D":>5}{"L":>5}{"GD":>6}')
+    for name, wins, draws, losses, difference in topPlayers(conn, int(options.get('--top', 10))):
+        print(f'{name:<20}{wins:>5}{draws:>5}{losses:>5}{difference:>+6}')
+    print('Recent matches')
+    for a, b, sa, sb in recentMatches(conn, int(options.get('--recent', 10))):
+        print(f'  {a} {sa} - {sb} {b}')
+    conn.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,32 +1,93 @@
+import json
 import os
 import sys
 import time
+#Time the game was started, for the time to first frame
+START_TIME = time.perf_counter()
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
 import pygame
-from sprites import Player, Ball
-from widgets import Button, InputBox, Screen
-pygame.init()
-
-def resourcePath(relativePath='', subdir='', path=False):
-    ''' Returns absolute path of project resource '''
-    try:
-        basePath = sys._MEIPASS
-    except AttributeError:
-        if relativePath.endswith('.txt'):
-            folder = 'Text files'
-        else:
-            folder = 'Images'
-        basePath = os.path.abspath(folder)
-        basePath = os.path.join(basePath, subdir)
-    if path:
-        return basePath
-    return os.path.join(basePath, relativePath)
-
-#Defining some colours:
-RED = (255, 55, 55)
-BLUE = (20, 20, 255)
+from assets import assets, resourcePath
+from commandline import parseArgs, addressOption, choiceOption, intOption, sizeOption
+from display import display
+from ai import CPUController, DIFFICULTIES
+from fonts import getFont, renderText, textCache
+from history import history
+from physics import (
+    Match, SnapshotBuffer, MAX_FRAME_TIME, TICK, WIDTH, HEIGHT, malletPositions, puckPositions
+    )
+from profiler import profiler
+from network import NetworkClient
+from replay import Recorder
+from scenes import SceneManager
+from scheduler import PhaseMonitor, Scheduler
+from sprites import Player, Ball, RED, BLUE
+from widgets import Button, DirtyRenderer, InputBox, Screen
+
+#Flags that take no value, every other flag takes one
+SWITCHES = (
+    '--stats', '--record', '--telemetry', '--profile', '--vsync', '--smooth', '--2v2', '--startup',
+    '--swept'
+    )
+#Flags of the game itself, not of a tool that imports this module
+_, OPTIONS = parseArgs(sys.argv[1:] if __name__ == '__main__' else [], SWITCHES)
+#Printing the game phase timings and cache counters when run with --stats
+SHOW_STATS = '--stats' in OPTIONS
+#Recording each match to a replay file when run with --record
+RECORD = '--record' in OPTIONS
+#Recording per-tick telemetry of each match to a .npz file when run with --telemetry
+TELEMETRY = '--telemetry' in OPTIONS
+#Playing against the computer when run with --cpu easy|medium|hard
+CPU = choiceOption(OPTIONS, '--cpu', DIFFICULTIES)
+#Timing each frame's phases when run with --profile, F3 shows the overlay
+PROFILE = '--profile' in OPTIONS
+#Exporting a Chrome trace of every frame when run with --trace FILE
+TRACE = OPTIONS.get('--trace')
+#Joining a network match when run with --connect host:port
+SERVER = addressOption(OPTIONS, '--connect')
+#Capping the frame rate with --fps N, 0 for uncapped; physics always ticks at 60 Hz
+RENDER_FPS = intOption(OPTIONS, '--fps', 60)
+#Syncing frames to the display refresh when run with --vsync
+VSYNC = '--vsync' in OPTIONS
+#Opening the window at another size with --window WxH, the game is scaled to fit
+WINDOW = sizeOption(OPTIONS, '--window', (WIDTH, HEIGHT))
+#Scaling with filtering instead of nearest pixels when run with --smooth
+SMOOTH = '--smooth' in OPTIONS
+#Playing with several pucks when run with --pucks N
+PUCKS = intOption(OPTIONS, '--pucks', 1)
+#Playing two against two when run with --2v2
+TEAM_SIZE = 2 if '--2v2' in OPTIONS else 1
+#Sweeping pucks against mallets and walls when run with --swept, so faster pucks never tunnel
+SWEPT = '--swept' in OPTIONS
+#Printing the time to first frame and quitting once loaded when run with --startup
+STARTUP = '--startup' in OPTIONS
+#Saving with F5 and loading with F9 to and from --save FILE
+SAVE_PATH = OPTIONS.get('--save', 'airhockey_save.json')
+#Resuming a saved match when run with --resume FILE
+RESUME = OPTIONS.get('--resume')
+#Keeping the match history in another database file with --history FILE
+HISTORY_PATH = OPTIONS.get('--history')
+
+#Defining some colours, next to the team colours from sprites:
 YELLOW = (255, 255, 0)
 
+#Folders and name prefixes of the header animation frames
+HEADER_FRAMES = (
+    ('Start screen', 'start_frame'),
+    ('Control screen', 'controls_frame'),
+    ('Pause screen', 'pause_frame'),
+    ('End screen', 'end_frame')
+    )
+
+def drawPanel(screen, font, title, lines, pos):
+    ''' Draws a title with lines of text below it, or nothing without lines '''
+    if not lines:
+        return
+    x, y = pos
+    for i, line in enumerate([title] + lines):
+        text = renderText(font, line, RED if i == 0 else BLUE)
+        screen.blit(text, (x, y))
+        y += text.get_height()
+
 class Animation:
     ''' Class for game animations '''
     def __init__(self, frames, pos):
@@ -41,16 +102,56 @@ class Animation:
             self.count = 0
         screen.blit(self.frames[self.count//2], self.pos)
 
+class LoadingScreen(Screen):
+    ''' Class for the loading screen shown while the header frames decode '''
+    def __init__(self, screen, nextScreen):
+        super().__init__(screen)
+        #Creates the screen to show once loaded
+        self.nextScreen = nextScreen
+        self.times = {}
+
+    def enter(self):
+        for subdir, prefix in HEADER_FRAMES:
+            assets.prefetch(os.path.join('Header frames', subdir), prefix)
+
+    def update(self, dt):
+        ''' Swaps in the next screen once every frame is decoded '''
+        if 'firstFrame' not in self.times or assets.progress() < 1:
+            return
+        scene = self.nextScreen()
+        self.times['ready'] = (time.perf_counter() - START_TIME)*1000
+        if STARTUP:
+            print(json.dumps(self.times))
+            self.manager.quit()
+            return
+        if SHOW_STATS:
+            print(
+                f'Time to first frame: {self.times["firstFrame"]:.0f} ms, '
+                f'ready in {self.times["ready"]:.0f} ms'
+                )
+        self.manager.replace(scene)
+
+    def redrawGame(self):
+        ''' Redraws the loading screen with a progress bar '''
+        self.drawHockeyGround()
+        text = renderText(self.font, 'Loading...', RED)
+        rect = text.get_rect(center=(self.w//2, self.h//2 - 50))
+        self.screen.blit(text, rect)
+        bar = pygame.Rect(0, 0, 300, 20)
+        bar.center = (self.w//2, self.h//2)
+        pygame.draw.rect(self.screen, RED, (bar.x, bar.y, bar.w*assets.progress(), bar.h))
+        pygame.draw.rect(self.screen, BLUE, bar, 2)
+        with profiler.phase('display'):
+            display.present()
+        if 'firstFrame' not in self.times:
+            self.times['firstFrame'] = (time.perf_counter() - START_TIME)*1000
+
 class ControlScreen(Screen):
     ''' Class for the game controls screen '''
     def __init__(self, screen):
         super().__init__(screen)
         self.subPath = os.path.join('Header frames', 'Control screen')
-        base = resourcePath(path=True, subdir=self.subPath)
-        frames = [
-            pygame.image.load(resourcePath(img, subdir=self.subPath))
-            for img in os.listdir(base) if img.startswith('controls_frame')
-            ]
+        frames = assets.getFrames(self.subPath, 'controls_frame')
         self.title = Animation(frames, (self.w//4 - 10, 0))
         self.ball = Ball(self.w//2, self.h//2, 20)
         self.sprites.add(
@@ -61,18 +162,17 @@ class ControlScreen(Screen):
             delimiter = f.read(1)
             self.text = f.read()
         self.controls = self.text.split(delimiter)
-        self.mainloop()
+        self.backBtn = Button(self.screen, (0, 0), '\u2190', pad=2)
 
     def displayUI(self):
-        ''' Displays the controls text, and inits back button '''
+        ''' Displays the controls text and back button '''
         xStart = 235
         yStart = 100
         xGap, yGap = 400, 40
         for i in range(len(self.controls)-1):
             for j, line in enumerate(self.controls[i].splitlines()):
-                text_render = self.font.render(line, 1, RED)
+                text_render = renderText(self.font, line, RED)
                 self.screen.blit(text_render, (xStart + i*xGap, yStart + j*yGap))
-        self.backBtn = Button(self.screen, (0, 0), '\u2190', pad=2)
         self.backBtn.draw()
 
     def redrawGame(self):
@@ -81,28 +181,34 @@ class ControlScreen(Screen):
         self.title.update(self.screen)
         self.displayUI()
         self.sprites.update(self.screen)
-        pygame.display.update()
-
-    def mainloop(self):
-        ''' Controls screen event loop '''
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    return
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_SPACE:
-                        return
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if self.backBtn.clicked():
-                        return
-            self.redrawGame()
-            self.clock.tick(self.FPS)
+        profiler.drawOverlay(self.screen)
+        with profiler.phase('display'):
+            display.present()
+
+    def handleEvent(self, event):
+        ''' Goes back to the start screen on space or the back button '''
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_SPACE:
+                self.manager.pop()
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if self.backBtn.clicked():
+                self.manager.pop()
 
 class StartScreen(Screen):
     ''' Class for the game start screen '''
-    def __init__(self, screen, entryText='Enter name'):
+    def __init__(self, screen, entryText='Enter name', startGame=None, game=None, matchHistory=None):
         super().__init__(screen)
-        self.exit = False
+        #Match history whose cached leaderboard is shown
+        self.matchHistory = matchHistory
+        self.panelFont = getFont('Verdana', 16)
+        #Creates the game for the entered names
+        self.startGame = startGame
+        #A game to show straight away, such as a resumed one
+        self.game = game
+        self.showGame = game is not None
+        #Why the last game could not start, shown under the buttons
+        self.message = None
+        self.controlScreen = None
         y = 425
         self.controlsBtn = Button(
             self.screen, (self.w//2-190, y), 'Controls', pad=6, center=1
@@ -110,11 +216,7 @@ class StartScreen(Screen):
         self.startBtn = Button(self.screen, (self.w//2, y), 'Start', pad=6, center=1)
         self.quitBtn = Button(self.screen, (self.w//2+160, y), 'Quit', pad=6, center=1)
         self.subPath = os.path.join('Header frames', 'Start screen')
-        base = resourcePath(path=True, subdir=self.subPath)
-        frames = [
-            pygame.image.load(resourcePath(img, subdir=self.subPath))
-            for img in os.listdir(base) if img.startswith('start_frame')
-            ]
+        frames = assets.getFrames(self.subPath, 'start_frame')
         self.title = Animation(frames, (self.w//4 - 10, 0))
         self.sprites = pygame.sprite.Group()
         self.ball = Ball(self.w//2, self.h//2, 20)
@@ -126,11 +228,9 @@ class StartScreen(Screen):
             InputBox(self.w//5-25, self.h//2-40, 200, 75, entryText),
             InputBox(self.w//2+100, self.h//2-40, 200, 75, entryText)
             ]
-        self.mainloop()
 
     def redrawGame(self):
         ''' Redraws the start screen '''
-        self.screen.fill((0, 200, 0))
         self.drawHockeyGround()
         #Updating sprites
         self.sprites.update(self.screen)
@@ -141,29 +241,60 @@ class StartScreen(Screen):
         for e in self.entryWidgets:
             e.draw(self.screen)
             e.update()
+        #Drawing the cached leaderboard and recent matches
+        if self.matchHistory:
+            drawPanel(
+                self.screen, self.panelFont, 'Top players',
+                self.matchHistory.leaderboardLines()[:4], (self.w//5-25, self.h//2+45)
+                )
+            drawPanel(
+                self.screen, self.panelFont, 'Recent matches',
+                self.matchHistory.recentLines()[:4], (self.w//2+100, self.h//2+45)
+                )
+        if self.message:
+            text = renderText(self.font, self.message, RED)
+            self.screen.blit(text, text.get_rect(center=(self.w//2, self.h-30)))
         #Drawing start title
         self.title.update(self.screen)
-        pygame.display.update()
-
-    def mainloop(self):
-        ''' Start screen event loop '''
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.exit = True
-                    return
-                [e.handle_event(event) for e in self.entryWidgets]
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if self.startBtn.clicked():
-                        if all(e.val for e in self.entryWidgets):
-                            return
-                    if self.quitBtn.clicked():
-                        self.exit = True
-                        return
-                    if self.controlsBtn.clicked():
-                        ControlScreen(self.screen)
-            self.redrawGame()
-            self.clock.tick(self.FPS)
+        profiler.drawOverlay(self.screen)
+        with profiler.phase('display'):
+            display.present()
+
+    def enter(self):
+        if self.showGame:
+            self.showGame = False
+            self.manager.push(self.game)
+
+    def handleEvent(self, event):
+        ''' Handles the name entries and menu buttons '''
+        [e.handle_event(event) for e in self.entryWidgets]
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if self.startBtn.clicked():
+                if all(e.val for e in self.entryWidgets):
+                    self.play()
+            elif self.quitBtn.clicked():
+                self.manager.quit()
+            elif self.controlsBtn.clicked():
+                if not self.controlScreen:
+                    self.controlScreen = ControlScreen(self.screen)
+                self.manager.push(self.controlScreen)
+
+    def play(self):
+        ''' Starts a game, reusing the last one if the same players return '''
+        names = self.getPlayerNames()
+        game = self.game
+        if game and game.names == names and not game.client:
+            game.restart()
+        else:
+            try:
+                game = self.startGame(names)
+            except ConnectionError as e:
+                #Staying on the start screen, so the players can try again
+                self.message = str(e)
+                return
+            self.game = game
+        self.message = None
+        self.manager.push(game)
 
     def getPlayerNames(self):
         ''' Returns the values from entry widgets '''
@@ -195,7 +326,7 @@ class PauseScreen(Screen):
             pad=5,
             center=1
             )
-        self.font = pygame.font.SysFont('Verdana', 35)
+        self.font = getFont('Verdana', 35)
         delim = '$'
         aboutText = f'''
         Air Hockey is a great two-player game! $RED
@@ -204,28 +335,22 @@ class PauseScreen(Screen):
         1. Be the first to score {scoreToWin} goals in {endTime} $RED
         2. Enjoy! $RED
         '''
-        self.aboutText = dict(
+        self.aboutText = {
+            line: eval(colour) for line, colour in
             [line.strip().split(delim) for line in aboutText.splitlines()[1:-1]]
-            )
+            }
         self.subPath = os.path.join('Header frames', 'Pause screen')
-        base = resourcePath(path=True, subdir=self.subPath)
-        frames = [
-            pygame.image.load(resourcePath(img, subdir=self.subPath))
-            for img in os.listdir(base) if img.startswith('pause_frame')
-            ]
+        frames = assets.getFrames(self.subPath, 'pause_frame')
         self.title = Animation(frames, (self.w//5-5, 0))
         self.restart = self.endGame = False
-        self.pauseTime = time.time()
-        self.mainloop()
 
     def redrawGame(self):
         ''' Redraws the pause screen '''
-        self.screen.fill((0, 200, 0))
         self.drawHockeyGround()
         #Drawing UI
         for i, line in enumerate(self.aboutText):
             self.screen.blit(
-                self.font.render(line, 1, eval(self.aboutText[line])),
+                renderText(self.font, line, self.aboutText[line]),
                 (self.w//4-100, i*50 + 125)
                 )
         self.endBtn.draw()
@@ -233,41 +358,31 @@ class PauseScreen(Screen):
         self.restartBtn.draw()
         #Drawing start title
         self.title.update(self.screen)
-        pygame.display.update()
+        profiler.drawOverlay(self.screen)
+        with profiler.phase('display'):
+            display.present()
 
-    def updateTime(self):
-        ''' Calculates the time paused '''
-        self.pauseTime = int(time.time() - self.pauseTime)
-
-    def mainloop(self):
-        ''' Pause screen event loop '''
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.updateTime()
-                    return
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if self.returnBtn.clicked():
-                        self.updateTime()
-                        return
-                    elif self.endBtn.clicked():
-                        self.endGame = True
-                        return
-                    elif self.restartBtn.clicked():
-                        self.restart = True
-                        return
-            self.redrawGame()
-            self.clock.tick(self.FPS)
+    def enter(self):
+        self.restart = self.endGame = False
+
+    def handleEvent(self, event):
+        ''' Goes back to the game, which acts on the button chosen '''
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if self.returnBtn.clicked():
+                self.manager.pop()
+            elif self.endBtn.clicked():
+                self.endGame = True
+                self.manager.pop()
+            elif self.restartBtn.clicked():
+                self.restart = True
+                self.manager.pop()
 
 class EndScreen(Screen):
     ''' Class for the game end screen '''
-    def __init__(self, screen, winners):
+    def __init__(self, screen, winners, names=None, matchHistory=None, draw=False):
         super().__init__(screen)
-        for i, winner in enumerate(winners):
-            winner.x = self.w//2 - 3.5*winner.r*(len(winners) - 1) + 7*winner.r*i
-            winner.y = self.h//2
-            winner.controls = None
-        self.winners = winners
+        self.matchHistory = matchHistory
+        self.panelFont = getFont('Verdana', 16)
         y = self.h - 40
         self.backBtn = Button(
             self.screen,
@@ -289,243 +404,588 @@ class EndScreen(Screen):
         '''
         self.creditsText = [line.strip() for line in creditsText.splitlines()[1:]]
         self.subPath = os.path.join('Header frames', 'End screen')
-        base = resourcePath(path=True, subdir=self.subPath)
-        frames = [
-            pygame.image.load(resourcePath(img, subdir=self.subPath))
-            for img in os.listdir(base) if img.startswith('end_frame')
-            ]
+        frames = assets.getFrames(self.subPath, 'end_frame')
         self.title = Animation(frames, (self.w//4 - 20, 10))
+        self.show(winners, names, draw)
+
+    def show(self, winners, names=None, draw=False):
+        ''' Sets the winners to show, lined up in the middle of the screen, and the players' names '''
+        self.winners = list(winners)
+        self.names = names
+        #Whether the match ended level, when every player is shown instead of the winners
+        self.draw = draw
+        self.positions = [
+            (self.w//2 - 3.5*winner.r*(len(self.winners) - 1) + 7*winner.r*i, self.h//2)
+            for i, winner in enumerate(self.winners)
+            ]
         self.playAgain = False
-        self.mainloop()
 
     def redrawGame(self):
         ''' Redraws the end screen '''
-        self.screen.fill((0, 200, 0))
         self.drawHockeyGround()
         #Drawing UI
         self.backBtn.draw()
         self.playBtn.draw()
         for i, line in enumerate(self.creditsText):
             self.screen.blit(
-                self.font.render(line, 1, RED),
+                renderText(self.font, line, RED),
                 (self.w//4 + 25, i*50 + self.h//2 + 80)
                 )
-        #Displaying win text
-        text = self.font.render(
+        #Displaying win text, or the draw
+        if self.draw:
+            text = renderText(self.font, 'Draw!', RED)
+        else:
+            text = renderText(
+                self.font,
                 ' and '.join(w.name for w in self.winners) +
-                ' win' + 's'*(not bool(len(self.winners)-1)) + '!', 1, RED
+                ' win' + 's'*(len(self.winners) == 1) + '!', RED
                 )
         rect = text.get_rect()
         rect.center = (self.w//2, self.h//2 - 100)
         self.screen.blit(text, (rect.x, rect.y))
-        drawText = self.font.render('Draw'*(bool(len(self.winners)-1)), 1, RED)
-        rect = drawText.get_rect()
-        rect.center = (self.w//2, self.h//2)
-        self.screen.blit(drawText, (rect.x, rect.y))
         #Drawing start title
         self.title.update(self.screen)
         #Drawing winner sprite
-        for winner in self.winners:
-            winner.update(self.screen)
-        pygame.display.update()
-
-    def mainloop(self):
-        ''' Win screen event loop '''
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    return
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if self.backBtn.clicked():
-                        return
-                    if self.playBtn.clicked():
-                        self.playAgain = True
-                        return
-            self.redrawGame()
-            self.clock.tick(self.FPS)
+        for winner, pos in zip(self.winners, self.positions):
+            winner.blitSurface(self.screen, pos)
+        #Drawing the cached head to head record and leaderboard
+        if self.matchHistory:
+            if self.names:
+                record = self.matchHistory.get(('headToHead', *self.names))
+                if record:
+                    a, b = self.names
+                    drawPanel(
+                        self.screen, self.panelFont, 'Head to head',
+                        [f'{a} {record[0]} - {record[1]} {b}', f'{record[2]} draws'],
+                        (self.w//6, self.h//4 + 15)
+                        )
+            drawPanel(
+                self.screen, self.panelFont, 'Top players',
+                self.matchHistory.leaderboardLines(), (self.w*5//8, self.h//4 + 15)
+                )
+        profiler.drawOverlay(self.screen)
+        with profiler.phase('display'):
+            display.present()
+
+    def handleEvent(self, event):
+        ''' Goes back to the game, which restarts or returns to the menu '''
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if self.backBtn.clicked():
+                self.manager.pop()
+            elif self.playBtn.clicked():
+                self.playAgain = True
+                self.manager.pop()
 
 class Game(Screen):
     ''' Class for the main game screen '''
     def __init__(self, screen, names, **kwargs):
         super().__init__(screen, fontsize=40)
-        self.displayFont = pygame.font.SysFont('Garamond', 125)
+        self.displayFont = getFont('Garamond', 125)
         self.pauseBtn = Button(self.screen, (self.w//2-70, self.h-100), 'Pause', pad=5)
-        self.ball = Ball(self.w//2, self.h//2, 20, (0, self.w), (0, self.h))
+        self.teamSize = kwargs.get('teamSize', 1)
+        self.balls = [
+            Ball(x, y, 20, (0, self.w), (0, self.h))
+            for x, y in puckPositions(self.w, self.h, kwargs.get('puckCount', 1))
+            ]
+        self.ball = self.balls[0]
         self.playerSprites = pygame.sprite.Group()
-        self.playerSprites.add(
-            Player(
-                75, self.h//2-10, 35, RED,
-                (0, self.w//2), (0, self.h),
-                controls='WSAD'
-                ),
-            Player(
-                self.w-75, self.h//2-10, 35, BLUE,
-                (self.w//2, self.w), (0, self.h),
-                controls='IKJL'
-                )
-            )
-        self.sprites.add(*self.playerSprites, self.ball)
-        for i, sprite in enumerate(self.sprites):
-            if i == len(names):
-                break
-            sprite.name = names[i]
+        #Adding both goalies first, so the first two inputs are the usual players'
+        left, right = malletPositions(self.w, self.h, self.teamSize)
+        teams = ((left, RED, (0, self.w//2)), (right, BLUE, (self.w//2, self.w)))
+        controls = (({'controls': 'WSAD'}, {'controls': 'IKJL'}), (
+            {'controls': 'TGFH'}, {'arrowKeyControls': True}
+            ))
+        for k in range(self.teamSize):
+            for team, (positions, colour, xLimits) in enumerate(teams):
+                x, y = positions[k]
+                player = Player(x, y, 35, colour, xLimits, (0, self.h), **controls[k][team])
+                if team < len(names):
+                    player.name = names[team] + f' {k + 1}'*(k > 0)
+                self.playerSprites.add(player)
+        self.sprites.add(*self.playerSprites, *self.balls)
+        self.names = names
         #Defining game play attributes
-        self.elapsedTime = '00:00'
-        self.showTime = True
-        self.showGoal = False
-        self.run = False
-        self.goalCounter = 0
         self.endTime = kwargs.get('endTime', '01:00')
         self.goalTextTime = kwargs.get('goalTextTime', 2)
         self.goalWaitTime = kwargs.get('goalWaitTime', 1)
+        #Seconds before a goal replayed under the goal banner, and seconds of ticks kept
+        self.goalReplayTime = kwargs.get('goalReplayTime', 1.5)
+        self.historyTime = kwargs.get('historyTime', 5)
+        #Seconds taken back by backspace, as far as the captured ticks reach
+        self.rewindTime = kwargs.get('rewindTime', 3)
         self.scoreToWin = kwargs.get('scoreToWin', 7)
-        self.startTime = time.time()
-        self.mainloop()
+        #Swept collisions, which allow a higher puck speed ceiling
+        self.swept = kwargs.get('swept', False)
+        self.replay = kwargs.get('replay')
+        self.client = kwargs.get('client')
+        #Controllers that drive players instead of the keyboard, None for keyboard
+        self.controllers = list(kwargs.get('controllers', []))
+        self.controllers += [None]*(len(self.playerSprites) - len(self.controllers))
+        if self.client:
+            #Playing by the rules of the server
+            self.endTime = self.client.rules['endTime']
+            self.scoreToWin = self.client.rules['scoreToWin']
+        self.seed = kwargs.get('seed')
+        #Match history that finished matches are written to
+        self.matchHistory = kwargs.get('matchHistory')
+        if self.matchHistory and len(names) == 2:
+            #Asking for the head to head record now, so it is cached by the end of the match
+            self.matchHistory.watch(*names)
+        #Replay file name, formatted with the time each match starts
+        self.recordPath = kwargs.get('recordPath')
+        #Telemetry file name, formatted the same way
+        self.telemetryPath = kwargs.get('telemetryPath')
+        self.telemetry = None
+        self.renderer = DirtyRenderer(self.screen, self.getHockeyGround())
+        #The pause and end screens are built on first use and kept for later matches
+        self.pauseScreen = None
+        self.endScreen = None
+        self.recorder = None
+        self.newMatch()
+
+    def newMatch(self):
+        ''' Puts the players and pucks back and starts a new match '''
+        for player in self.playerSprites:
+            player.reset()
+            player.score = 0
+        for ball in self.balls:
+            ball.reset((1, 0), served=False)
+        for sprite in self.sprites:
+            sprite.savePosition()
+        self.sprites.add(*self.balls)
+        self.elapsedTime = '00:00'
+        self.showTime = True
+        self.showGoal = False
+        self.showTimeUp = False
+        self.finished = False
+        self.phase = 'play'
+        if self.replay:
+            self.match = self.replay.createMatch(
+                w=self.w, h=self.h, mallets=list(self.playerSprites), puck=self.ball
+                )
+            self.replayInputs = self.replay.inputs()
+        else:
+            self.match = Match(
+                self.w, self.h,
+                mallets=list(self.playerSprites),
+                pucks=self.balls,
+                endTime=self.endTime,
+                scoreToWin=self.scoreToWin,
+                seed=self.seed,
+                swept=self.swept
+                )
+        #Replay files only describe one against one with a single puck
+        if self.recordPath and len(self.playerSprites) == 2 and len(self.balls) == 1:
+            self.recorder = Recorder(time.strftime(self.recordPath), self.match, self.names)
+        if self.telemetryPath and not self.client:
+            #Importing here, so NumPy is not loaded at startup unless telemetry is on
+            from telemetry import TelemetryRecorder
+            self.telemetry = TelemetryRecorder(self.match)
+            self.telemetryFile = time.strftime(self.telemetryPath)
+        self.history = SnapshotBuffer(self.match, self.historyTime)
+        self.replayIndex = None
+        self.renderer.invalidate()
+        self.scheduler = Scheduler()
+        self.monitor = PhaseMonitor()
+        self.monitor.enter(self.phase)
+        self.accumulator = 0
+        #Fraction of a tick to draw the sprites ahead of their previous positions
+        self.alpha = 1
+
+    def finishMatch(self):
+        ''' Closes the replay and telemetry files and reports the phase timings of the match '''
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        if self.telemetry:
+            self.telemetry.flush(self.telemetryFile)
+            self.telemetry = None
+        if SHOW_STATS and self.monitor:
+            print(self.monitor.report())
+        self.monitor = None
+
+    def restart(self):
+        self.finishMatch()
+        self.newMatch()
+
+    def leave(self):
+        self.finishMatch()
+
+    def setPhase(self, phase):
+        ''' Switches the game phase '''
+        self.phase = phase
+        self.monitor.enter(phase)
 
     def resetGame(self):
-        ''' Resets sprites to default and adds up player score '''
-        symbols = '<>'
-        for sprite in self.sprites:
-            sprite.x = sprite.defaultX
-            sprite.y = sprite.defaultY
-            if not any(
-                eval(
-                    f'self.ball.x{sym}self.w//2 and sprite.x{sym}self.w//2',
-                    {'self': self, 'sprite': sprite}
-                    )
-                    for sym in symbols
-                    ):
-                sprite.score += 1
-
-        self.ball = Ball(self.w//2, self.h//2, 20, (0, self.w), (0, self.h))
+        ''' Puts the ball back on the field and waits for the faceoff '''
+        self.endGoalReplay()
+        self.showGoal = False
+        self.showTime = True
         self.sprites.add(self.ball)
-
-        self.redrawGame()
-        self.goalCounter = time.time()
-        while time.time() - self.goalCounter <= self.goalWaitTime:
-            pass
-        self.ball.lastTouched = True
-        self.goalCounter = 0
+        self.setPhase('faceoff')
+        self.scheduler.after(self.goalWaitTime, lambda: self.setPhase('play'))
 
     def displayText(self, text, pos):
         ''' Displas game announcements '''
-        text = self.displayFont.render(text, 1, RED)
-        self.screen.blit(text, pos)
+        text = renderText(self.displayFont, text, RED)
+        return self.screen.blit(text, pos)
+
+    def announceGoal(self):
+        ''' Shows the goal announcement and its replay, then resets the game '''
+        self.showTime = False
+        self.showGoal = True
+        self.setPhase('goal')
+        self.startGoalReplay()
+        self.scheduler.after(self.goalTextTime, self.resetGame)
+
+    def startGoalReplay(self):
+        ''' Starts playing back the ticks before the goal '''
+        #Keeping the state after the goal to put back when the replay ends
+        self.afterGoal = self.match.snapshot()
+        self.replayIndex = max(len(self.history) - round(self.goalReplayTime/TICK), 0)
+        if not self.history:
+            self.endGoalReplay()
+            return
+        self.history.restore(self.replayIndex, scores=False)
+        for sprite in self.sprites:
+            sprite.savePosition()
+        self.replayIndex += 1
+
+    def updateGoalReplay(self, dt):
+        ''' Steps the goal replay through the captured ticks '''
+        self.accumulator += min(dt, MAX_FRAME_TIME)
+        while self.accumulator >= TICK:
+            self.accumulator -= TICK
+            if self.replayIndex >= len(self.history):
+                self.endGoalReplay()
+                return
+            for sprite in self.sprites:
+                sprite.savePosition()
+            self.history.restore(self.replayIndex, scores=False)
+            self.replayIndex += 1
+        self.alpha = self.accumulator/TICK
+
+    def endGoalReplay(self):
+        ''' Puts the match back in its state after the goal '''
+        if self.replayIndex is None:
+            return
+        self.replayIndex = None
+        self.match.restore(self.afterGoal)
+        #The next goal's replay should not reach back before this one
+        self.history.clear()
+        #Hiding the ball until the faceoff
+        self.ball.kill()
+        for sprite in self.sprites:
+            sprite.savePosition()
+        self.accumulator = 0
+        self.alpha = 1
+
+    def saveMatch(self, path):
+        ''' Writes the settings and state of the match, so it can be resumed later '''
+        saved = {
+            'names': self.names, 'seed': self.match.seed,
+            'endTime': self.endTime, 'scoreToWin': self.scoreToWin,
+            'teamSize': self.teamSize, 'puckCount': len(self.balls),
+            'swept': self.match.swept, 'state': self.match.snapshot()
+            }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(saved, f)
+
+    def restoreMatch(self, state):
+        ''' Puts the match in a saved state '''
+        self.match.restore(state)
+        self.history.clear()
+        self.jumped()
+
+    def rewind(self):
+        ''' Takes the match back rewindTime seconds, as far as the captured ticks reach '''
+        if self.history.rewind(round(self.rewindTime/TICK)):
+            self.jumped()
+
+    def jumped(self):
+        ''' Redraws the match after it was put in another state '''
+        #A replay file records a match from its start, so it cannot follow a jump
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        for sprite in self.sprites:
+            sprite.savePosition()
+        self.updateTime()
+        self.renderer.invalidate()
 
-    def checkGoal(self):
-        ''' Resets game if goal is scored '''
-        if self.ball.alive():
+    def quickLoad(self, path):
+        ''' Restores the match saved with F5, if it fits this game '''
+        if not os.path.exists(path):
             return
-        if not self.goalCounter:
-            self.goalCounter = time.time()
-            self.showTime = False
-            self.showGoal = True
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved['seed'] == self.match.seed and len(saved['state']) == self.match.stateSize:
+            self.restoreMatch(saved['state'])
+
+    def flashGoal(self):
+        ''' Shows the goal announcement while play carries on '''
+        self.showGoal = True
+        self.scheduler.after(self.goalTextTime, self.hideGoal)
+
+    def announceTimeUp(self):
+        ''' Shows the time up announcement, then ends the game '''
+        for ball in self.balls:
+            ball.kill()
+        self.showTimeUp = True
+        self.setPhase('timeUp')
+        self.scheduler.after(self.goalTextTime, lambda: self.setPhase('over'))
+
+    def hideGoal(self):
+        self.showGoal = False
+
+    def updateFromServer(self):
+        ''' Sends the local player's inputs and shows the server's match state '''
+        sprites = list(self.playerSprites)
+        self.client.postInput(sprites[self.client.slot].readInput())
+        state = self.client.interpolate()
+        if state is None:
+            return
+        self.ball.x, self.ball.y = state['puck']
+        scored = False
+        for sprite, (x, y), score in zip(sprites, state['mallets'], state['scores']):
+            sprite.x, sprite.y = x, y
+            scored |= score > sprite.score
+            sprite.score = score
+        self.match.ticks = state['ticks']
+        if scored:
+            #The server serves straight away, so only the banner is shown
+            self.flashGoal()
+
+    def readInputs(self):
+        ''' Returns the input bitmasks of both players for this tick '''
+        if self.replay:
+            return next(self.replayInputs, None)
+        return [
+            controller.getInput(self.match, sprite) if controller else sprite.readInput()
+            for sprite, controller in zip(self.playerSprites, self.controllers)
+            ]
 
-        if time.time() - self.goalCounter >= self.goalTextTime:
-            self.showGoal = False
-            self.resetGame()
-            self.showTime = True
-            self.startTime += self.goalTextTime + self.goalWaitTime
+    def tickGame(self):
+        ''' Advances the match by one tick using the players' controls '''
+        inputs = self.readInputs()
+        if inputs is None:
+            #The replay has run out
+            self.setPhase('over')
+            return
+        if self.recorder:
+            self.recorder.record(inputs)
+        for sprite in self.sprites:
+            sprite.savePosition()
+        self.history.capture()
+        goal = self.match.tick(inputs)
+        if self.telemetry:
+            self.telemetry.record()
+        if goal:
+            #Not drawing the serve as a slide back to the centre
+            for sprite in self.sprites:
+                sprite.savePosition()
+            if len(self.balls) > 1:
+                self.flashGoal()
+            else:
+                self.announceGoal()
+
+    def updateGame(self, dt=TICK):
+        ''' Runs the fixed physics ticks that fit in dt seconds of play '''
+        if self.client:
+            self.updateFromServer()
+            self.alpha = 1
+            return
+        self.accumulator += min(dt, MAX_FRAME_TIME)
+        while self.accumulator >= TICK:
+            self.accumulator -= TICK
+            self.tickGame()
+            if self.phase != 'play':
+                self.accumulator = 0
+                break
+        self.alpha = self.accumulator/TICK
 
     def updateTime(self):
         ''' Updating game time '''
-        diff = int(time.time() - self.startTime)
-        self.elapsedTime = ':'.join(
-            [str(val).zfill(2) for val in divmod(diff, 60)]
-            )
+        self.elapsedTime = self.match.elapsedTime
 
     def redrawGame(self):
-        ''' Redraws entire game screen '''
-        self.screen.fill((0, 200, 0))
-        #Drawing Hockey Ground
-        self.drawHockeyGround()
-        #Drawing game time
-        if self.showTime:
-            text = self.font.render(self.elapsedTime, 1, RED)
-            self.screen.blit(text, (self.w//2 - 53, 50))
-        if self.showGoal:
-            self.displayText('Goal!', (self.w//3 + 25, self.h//4 + 50))
-        #Updating sprites
-        self.sprites.update(self.screen)
-        [sprite.checkCollision(self.ball) for sprite in self.playerSprites]
+        ''' Redraws the changed parts of the game screen '''
+        self.renderer.clear()
+        with profiler.phase('text'):
+            #Drawing game time
+            if self.showTime:
+                text = renderText(self.font, self.elapsedTime, RED)
+                self.renderer.add(self.screen.blit(text, (self.w//2 - 53, 50)))
+            if self.showGoal:
+                self.renderer.add(self.displayText('Goal!', (self.w//3 + 25, self.h//4 + 50)))
+            if self.showTimeUp:
+                self.renderer.add(self.displayText('Time Up!', (self.w//3-50, self.h//4 + 40)))
+        #Drawing sprites
+        with profiler.phase('sprites'):
+            for sprite in self.sprites:
+                self.renderer.add(*sprite.update(self.screen, self.alpha))
         #Updating game time
         self.updateTime()
         #Drawing UI
-        self.pauseBtn.draw()
-        pygame.display.update()
+        with profiler.phase('ui'):
+            self.renderer.add(self.pauseBtn.draw())
+            self.renderer.add(profiler.drawOverlay(self.screen))
+        with profiler.phase('display'):
+            self.renderer.update()
 
     def getWinner(self):
-        ''' Compares player scores and returns the winner '''
-        maxScore = -1
-        for sprite in self.playerSprites:
-            if sprite.score == maxScore:
-                winner = None
-                break
-            if sprite.score > maxScore:
-                winner = sprite
-                maxScore = sprite.score
-        return winner
+        ''' Compares team scores and returns the winning players '''
+        return self.match.getWinningTeam()
 
-
-    def gameOver(self, winner=None):
-        ''' Creates an end screen instance and checks for Play Again '''
-        self.ball.kill()
-        end = EndScreen(
-            self.screen,
-            pygame.sprite.GroupSingle(winner) if winner else self.sprites
+    def recordResult(self):
+        ''' Queues the final scores for the match history, never waiting on the disk '''
+        if not self.matchHistory or self.replay or len(self.names) != 2:
+            return
+        team = self.match.getWinningTeam()
+        self.matchHistory.recordMatch(
+            self.names, [team[0].score for team in self.match.teams],
+            None if team is None else self.match.teams.index(team),
+            self.match.ticks, self.match.seed
             )
-        self.run = end.playAgain
-
-    def mainloop(self):
-        ''' Main game event loop '''
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    return
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if self.pauseBtn.clicked():
-                        pauseScreen = PauseScreen(self.screen, self.scoreToWin, self.endTime)
-                        self.run = pauseScreen.restart
-                        if self.run:
-                            return
-                        if pauseScreen.endGame:
-                            self.gameOver(self.getWinner())
-                            return
-                        self.startTime += pauseScreen.pauseTime
-            self.checkGoal()
-            #Checking if player has scored the required no. of goals to win
-            for sprite in self.playerSprites:
-                if sprite.score == self.scoreToWin:
-                    self.gameOver(sprite)
-                    return
-            #Checking if time is up
-            if self.elapsedTime == self.endTime and self.showTime:
-                self.ball.kill()
-                self.redrawGame()
-                self.displayText('Time Up!', (self.w//3-50, self.h//4 + 40))
-                pygame.display.update()
-                counter = time.time()
-                while time.time() - counter < self.goalTextTime:
-                    pass
+
+    def gameOver(self, winners=None):
+        ''' Shows the end screen over the game '''
+        for ball in self.balls:
+            ball.kill()
+        self.recordResult()
+        #No winning team is a draw, which shows every player
+        draw = winners is None
+        winners = winners or list(self.playerSprites)
+        names = tuple(self.names) if len(self.names) == 2 else None
+        if self.endScreen:
+            self.endScreen.show(winners, names, draw)
+        else:
+            self.endScreen = EndScreen(self.screen, winners, names, self.matchHistory, draw)
+        self.finished = True
+        self.manager.push(self.endScreen)
+
+    def pause(self):
+        ''' Shows the pause screen over the game '''
+        self.monitor.enter('paused')
+        if not self.pauseScreen:
+            self.pauseScreen = PauseScreen(self.screen, self.scoreToWin, self.endTime)
+        self.manager.push(self.pauseScreen)
+
+    def resume(self):
+        ''' Acts on the choice made in the pause or end screen '''
+        self.renderer.invalidate()
+        if self.finished:
+            #Network matches are run by the server, so they cannot be replayed here
+            if self.endScreen.playAgain and not self.client:
+                self.restart()
+            else:
+                if self.client:
+                    self.client.close()
+                self.manager.pop()
+            return
+        self.monitor.enter(self.phase)
+        if self.pauseScreen.restart:
+            self.restart()
+        elif self.pauseScreen.endGame:
+            self.gameOver(self.getWinner())
+
+    def handleEvent(self, event):
+        ''' Handles the pause button, quick saves, rewinds and window resizes '''
+        if event.type == pygame.VIDEORESIZE:
+            #Repainting the whole resized window
+            self.renderer.invalidate()
+        if event.type == pygame.KEYDOWN and self.phase == 'play' and not (self.client or self.replay):
+            if event.key == pygame.K_F5:
+                self.saveMatch(SAVE_PATH)
+            elif event.key == pygame.K_F9:
+                self.quickLoad(SAVE_PATH)
+            elif event.key == pygame.K_BACKSPACE:
+                self.rewind()
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if self.pauseBtn.clicked():
+                self.pause()
+
+    def update(self, dt):
+        ''' Runs the scheduled events, rules and physics of one frame '''
+        with profiler.phase('scheduler'):
+            self.scheduler.update(dt)
+        if self.phase == 'over':
+            self.gameOver(self.getWinner())
+            return
+        if self.phase == 'goal' and self.replayIndex is not None:
+            self.updateGoalReplay(dt)
+        if self.phase == 'play':
+            #Checking if a team has scored the required no. of goals to win
+            if any(sprite.score >= self.scoreToWin for sprite in self.playerSprites):
                 self.gameOver(self.getWinner())
                 return
-            self.redrawGame()
-            self.clock.tick(self.FPS)
-
-#Initializing game window
-WIDTH = 1000
-HEIGHT = 500
-window = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption('Air Hockey!')
-pygame.display.set_icon(
-    pygame.image.load(resourcePath('icon.png', subdir='Game icons'))
-    )
-
-while True:
-    startScreen = StartScreen(window)
-    playerNames = startScreen.getPlayerNames()
-    if startScreen.exit:
-        break
-    while Game(window, playerNames, endTime='03:00').run:
-        pass
-pygame.quit()
+            #Checking if time is up
+            if self.match.timeUp:
+                self.announceTimeUp()
+            else:
+                with profiler.phase('physics'):
+                    self.updateGame(dt)
+
+def createWindow(width=WIDTH, height=HEIGHT, vsync=False, smooth=False):
+    ''' Initializes the game window, returns the logical canvas screens draw on '''
+    #Starting only the display, fonts start when first used and audio and joysticks never do
+    pygame.display.init()
+    window = display.open((width, height), vsync, smooth)
+    pygame.display.set_caption('Air Hockey!')
+    pygame.display.set_icon(
+        assets.getImage('icon.png', subdir='Game icons')
+        )
+    return window
+
+def createGame(window, names):
+    ''' Creates the game for the players entered on the start screen '''
+    if SERVER:
+        client = NetworkClient(names[0])
+        client.start(*SERVER)
+        return Game(window, names, client=client)
+    return Game(
+        window, names, endTime='03:00',
+        recordPath='match_%Y%m%d_%H%M%S.ahr' if RECORD else None,
+        telemetryPath='match_%Y%m%d_%H%M%S.npz' if TELEMETRY else None,
+        controllers=[None, CPUController(CPU) if CPU else None],
+        puckCount=PUCKS, teamSize=TEAM_SIZE, swept=SWEPT, matchHistory=history
+        )
+
+def resumeGame(window, path):
+    ''' Creates a game from a saved match, in the state it was saved in '''
+    with open(path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    game = Game(
+        window, saved['names'], endTime=saved['endTime'], scoreToWin=saved['scoreToWin'],
+        seed=saved['seed'], teamSize=saved['teamSize'], puckCount=saved['puckCount'],
+        swept=saved.get('swept', False),
+        controllers=[None, CPUController(CPU) if CPU else None], matchHistory=history
+        )
+    game.restoreMatch(saved['state'])
+    return game
+
+def main():
+    ''' Runs the game until the player quits '''
+    window = createWindow(*WINDOW, vsync=VSYNC, smooth=SMOOTH)
+    #Leaving the pacing to the display when it syncs the frames
+    Screen.defaultFPS = 0 if VSYNC else RENDER_FPS
+    profiler.enabled = PROFILE
+    if TRACE:
+        profiler.startTrace()
+    #Starting the history thread early, so the leaderboard is cached by the first frames
+    history.open(HISTORY_PATH)
+    SceneManager().run(LoadingScreen(window, lambda: StartScreen(
+        window, startGame=lambda names: createGame(window, names),
+        game=resumeGame(window, RESUME) if RESUME else None, matchHistory=history
+        )))
+    #Finishing the queued writes
+    history.close()
+    if SHOW_STATS:
+        print(assets.report())
+        print(textCache.report())
+    if TRACE:
+        profiler.saveTrace(TRACE)
+    pygame.quit()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,445 @@
+'''
+This module defines networked two-player matches over UDP with asyncio.
+The server runs the authoritative match and sends each client quantized
+snapshots, delta-compressed against the last snapshot the client acked.
+Includes:
+    1. Link with simulated latency and packet loss
+    2. Snapshot encoding
+    3. Match server
+    4. Network client
+Usage:
+    python network.py [server|selftest|goaltest] [--port N] [--latency S] [--loss P]
+        [--time MM:SS] [--score N]
+'''
+import asyncio
+import random
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+from commandline import parseArgs, intOption, floatOption
+from physics import TICK, Match, formatTime
+
+#Positions are sent in fixed point with this many steps per pixel
+SCALE = 8
+#Snapshot fields: puck x, puck y, mallet positions, scores, flags and match ticks,
+#as they are packed when sent in full
+FULL_VALUES = [struct.Struct('<H')]*9 + [struct.Struct('<I')]
+FIELDS = len(FULL_VALUES)
+FULL = 0xFFFFFFFF
+HISTORY = 120
+JOIN, WELCOME, INPUT, SNAPSHOT = b'J', b'W', b'I', b'S'
+#Type, slot, score to win, end time in seconds
+WELCOME_PACKET = struct.Struct('<cBBH')
+#Type, sequence, last acked tick, client send time, input bitmask
+INPUT_PACKET = struct.Struct('<cIIdB')
+#Type, snapshot number, base snapshot number, echoed client time, changed fields, small changes
+SNAPSHOT_HEADER = struct.Struct('<cIIdHH')
+TIME_UP, OVER = 1, 2
+
+class Link:
+    ''' Class that sends datagrams with simulated latency, jitter and packet loss '''
+    def __init__(self, transport, latency=0, jitter=0, loss=0, seed=None):
+        self.transport = transport
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.loop = asyncio.get_running_loop()
+        self.bytesSent = self.bytesReceived = 0
+        self.packetsSent = self.packetsDropped = 0
+        self.startTime = time.perf_counter()
+
+    def send(self, data, addr=None):
+        ''' Sends a datagram, unless the simulated network drops it '''
+        self.bytesSent += len(data)
+        self.packetsSent += 1
+        if self.rng.random() < self.loss:
+            self.packetsDropped += 1
+            return
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        if delay:
+            self.loop.call_later(delay, self.transport.sendto, data, addr)
+        else:
+            self.transport.sendto(data, addr)
+
+    def received(self, data):
+        self.bytesReceived += len(data)
+
+    def stats(self):
+        ''' Returns the traffic counters and rates '''
+        elapsed = max(time.perf_counter() - self.startTime, 1e-9)
+        return {
+            'bytesSent': self.bytesSent,
+            'bytesReceived': self.bytesReceived,
+            'sentPerSecond': self.bytesSent/elapsed,
+            'receivedPerSecond': self.bytesReceived/elapsed,
+            'packetsSent': self.packetsSent,
+            'packetsDropped': self.packetsDropped
+            }
+
+def quantize(match):
+    ''' Returns the match state as a tuple of fixed point integers '''
+    puck = match.puck
+    flags = TIME_UP*match.timeUp | OVER*match.over
+    state = [round(puck.x*SCALE), round(puck.y*SCALE)]
+    for mallet in match.mallets:
+        state += [round(mallet.x*SCALE), round(mallet.y*SCALE)]
+    return tuple(state + [mallet.score for mallet in match.mallets] + [flags, match.ticks])
+
+def encodeSnapshot(tick, state, base, baseTick, echo):
+    ''' Encodes a state as the fields that changed from base, or in full '''
+    changed = small = 0
+    values = b''
+    for i, value in enumerate(state):
+        if base is not None:
+            diff = value - base[i]
+            if not diff:
+                continue
+            if -128 <= diff <= 127:
+                small |= 1 << i
+                values += struct.pack('<b', diff)
+                changed |= 1 << i
+                continue
+        changed |= 1 << i
+        values += FULL_VALUES[i].pack(value)
+    if base is None:
+        baseTick = FULL
+    return SNAPSHOT_HEADER.pack(SNAPSHOT, tick, baseTick, echo, changed, small) + values
+
+def decodeSnapshot(data, history):
+    ''' Decodes a snapshot against the client's history, returns (tick, state, echo) '''
+    _, tick, baseTick, echo, changed, small = SNAPSHOT_HEADER.unpack_from(data)
+    if baseTick == FULL:
+        base = [0]*FIELDS
+    elif baseTick in history:
+        base = list(history[baseTick])
+    else:
+        return None
+    offset = SNAPSHOT_HEADER.size
+    for i in range(FIELDS):
+        if not changed & 1 << i:
+            continue
+        if small & 1 << i:
+            base[i] += struct.unpack_from('<b', data, offset)[0]
+            offset += 1
+        else:
+            base[i] = FULL_VALUES[i].unpack_from(data, offset)[0]
+            offset += FULL_VALUES[i].size
+    return tick, tuple(base), echo
+
+class MatchServer(asyncio.DatagramProtocol):
+    ''' Class for the authoritative server of a networked match '''
+    def __init__(self, latency=0, jitter=0, loss=0, **kwargs):
+        self.match = Match(**kwargs)
+        self.linkOptions = (latency, jitter, loss)
+        self.players = {}
+        self.inputs = [0, 0]
+        self.acks = {}
+        self.echoes = {}
+        self.history = OrderedDict()
+        #Number of the last snapshot sent, which a goal tick does not share with the tick before
+        self.sequence = 0
+        self.link = None
+        self.ready = asyncio.Event()
+
+    def connection_made(self, transport):
+        self.link = Link(transport, *self.linkOptions)
+
+    def datagram_received(self, data, addr):
+        self.link.received(data)
+        kind = data[:1]
+        if kind == JOIN:
+            if addr not in self.players and len(self.players) < 2:
+                self.players[addr] = len(self.players)
+            if addr in self.players:
+                self.link.send(WELCOME_PACKET.pack(
+                    WELCOME, self.players[addr],
+                    self.match.scoreToWin, self.match.endSeconds
+                    ), addr)
+            if len(self.players) == 2:
+                self.ready.set()
+        elif kind == INPUT and addr in self.players:
+            _, seq, ack, sent, mask = INPUT_PACKET.unpack(data)
+            #Ignoring inputs that arrive out of order
+            if seq < self.acks.get(addr, (0, 0))[0]:
+                return
+            self.acks[addr] = (seq, ack)
+            self.echoes[addr] = sent
+            self.inputs[self.players[addr]] = mask
+
+    def broadcast(self):
+        ''' Sends each player the current state, delta-compressed against its last ack '''
+        self.sequence += 1
+        tick = self.sequence
+        state = quantize(self.match)
+        self.history[tick] = state
+        while len(self.history) > HISTORY:
+            self.history.popitem(last=False)
+        for addr in self.players:
+            baseTick = self.acks.get(addr, (0, FULL))[1]
+            base = self.history.get(baseTick)
+            self.link.send(
+                encodeSnapshot(tick, state, base, baseTick, self.echoes.get(addr, 0)), addr
+                )
+
+    async def run(self):
+        ''' Waits for both players, then runs the match at the tick rate '''
+        await self.ready.wait()
+        loop = asyncio.get_running_loop()
+        nextTick = loop.time()
+        while not self.match.over:
+            self.match.tick(self.inputs)
+            self.broadcast()
+            nextTick += TICK
+            await asyncio.sleep(max(0, nextTick - loop.time()))
+        #Repeating the final state so lossy clients see the match end
+        for _ in range(10):
+            self.broadcast()
+            await asyncio.sleep(TICK)
+
+class NetworkClient(asyncio.DatagramProtocol):
+    ''' Class for a client that sends inputs and interpolates server snapshots '''
+    def __init__(self, name='', latency=0, jitter=0, loss=0, interpDelay=0.1):
+        self.name = name
+        self.linkOptions = (latency, jitter, loss)
+        self.interpDelay = interpDelay
+        self.link = None
+        self.slot = None
+        self.rules = None
+        self.seq = 0
+        self.history = OrderedDict()
+        self.snapshots = []
+        self.latestTick = -1
+        self.latestTime = 0
+        self.rtt = None
+        self.welcomed = threading.Event()
+        self.loop = None
+        #Thread and task running the client's own event loop when started with start
+        self.thread = None
+        self.task = None
+
+    def connection_made(self, transport):
+        self.link = Link(transport, *self.linkOptions)
+
+    def datagram_received(self, data, addr):
+        self.link.received(data)
+        kind = data[:1]
+        if kind == WELCOME:
+            _, self.slot, scoreToWin, endSeconds = WELCOME_PACKET.unpack(data)
+            self.rules = {
+                'scoreToWin': scoreToWin,
+                'endTime': formatTime(endSeconds)
+                }
+            self.welcomed.set()
+        elif kind == SNAPSHOT:
+            decoded = decodeSnapshot(data, self.history)
+            if decoded is None:
+                return
+            tick, state, echo = decoded
+            if echo:
+                self.rtt = time.perf_counter() - echo
+            if tick <= self.latestTick:
+                return
+            self.history[tick] = state
+            while len(self.history) > HISTORY:
+                self.history.popitem(last=False)
+            self.latestTick, self.latestTime = tick, time.perf_counter()
+            self.snapshots = (self.snapshots + [(tick, state)])[-HISTORY:]
+
+    async def connect(self, host, port):
+        ''' Opens the socket and joins the server, retrying until welcomed '''
+        self.loop = asyncio.get_running_loop()
+        await self.loop.create_datagram_endpoint(lambda: self, remote_addr=(host, port))
+        while not self.welcomed.is_set():
+            self.link.send(JOIN + self.name.encode('utf-8'))
+            await asyncio.sleep(0.2)
+
+    async def serve(self, host, port):
+        ''' Connects, then keeps the socket open until the client is closed '''
+        self.task = asyncio.current_task()
+        try:
+            await self.connect(host, port)
+            await asyncio.get_running_loop().create_future()
+        finally:
+            if self.link:
+                self.link.transport.close()
+
+    def start(self, host, port, timeout=5):
+        ''' Connects from a background thread, for use from the pygame loop '''
+        def run():
+            try:
+                asyncio.run(self.serve(host, port))
+            except (asyncio.CancelledError, OSError):
+                pass
+        self.thread = threading.Thread(target=run, name='network', daemon=True)
+        self.thread.start()
+        if not self.welcomed.wait(timeout):
+            self.close()
+            raise ConnectionError(f'No answer from server at {host}:{port}')
+
+    def close(self):
+        ''' Closes the socket, stopping the event loop of a client started with start '''
+        if self.thread:
+            if self.thread.is_alive():
+                self.loop.call_soon_threadsafe(self.task.cancel)
+                self.thread.join()
+            self.thread = None
+        elif self.link:
+            self.link.transport.close()
+
+    def sendInput(self, mask):
+        ''' Sends the local player's inputs and acks the latest snapshot '''
+        self.seq += 1
+        self.link.send(INPUT_PACKET.pack(
+            INPUT, self.seq, self.latestTick if self.latestTick >= 0 else FULL,
+            time.perf_counter(), mask
+            ))
+
+    def postInput(self, mask):
+        ''' Thread-safe sendInput for callers outside the client's event loop '''
+        self.loop.call_soon_threadsafe(self.sendInput, mask)
+
+    @property
+    def serverTick(self):
+        ''' Estimate of the server's current tick '''
+        return self.latestTick + (time.perf_counter() - self.latestTime + (self.rtt or 0)/2)/TICK
+
+    def interpolate(self):
+        ''' Returns the state interpDelay behind the server, or None before any snapshot '''
+        snapshots = self.snapshots
+        if not snapshots:
+            return None
+        renderTick = self.latestTick + (
+            time.perf_counter() - self.latestTime - self.interpDelay
+            )/TICK
+        older = newer = snapshots[-1]
+        for tick, state in reversed(snapshots):
+            if tick <= renderTick:
+                older = (tick, state)
+                break
+            newer = (tick, state)
+        (t0, s0), (t1, s1) = older, newer
+        alpha = (renderTick - t0)/(t1 - t0) if t1 > t0 else 0
+        alpha = min(max(alpha, 0), 1)
+        positions = [(a + (b - a)*alpha)/SCALE for a, b in zip(s0[:6], s1[:6])]
+        return {
+            'tick': t0,
+            'ticks': s1[9],
+            'puck': positions[0:2],
+            'mallets': [positions[2:4], positions[4:6]],
+            'scores': list(s1[6:8]),
+            'timeUp': bool(s1[8] & TIME_UP),
+            'over': bool(s1[8] & OVER)
+            }
+
+    def stats(self):
+        ''' Returns the traffic counters, tick lag and round trip time '''
+        stats = self.link.stats()
+        stats['tickLag'] = self.serverTick - self.latestTick if self.latestTick >= 0 else None
+        stats['rtt'] = self.rtt
+        return stats
+
+async def selfTest(seconds=5, latency=0.05, jitter=0.01, loss=0.05, port=5555):
+    ''' Plays a match between two random clients over localhost, prints metrics '''
+    loop = asyncio.get_running_loop()
+    endTime = formatTime(seconds)
+    server = MatchServer(latency, jitter, loss, endTime=endTime, seed=0)
+    await loop.create_datagram_endpoint(lambda: server, local_addr=('127.0.0.1', port))
+    clients = [NetworkClient(f'Bot {i}', latency, jitter, loss) for i in range(2)]
+    for client in clients:
+        await client.connect('127.0.0.1', port)
+    #Serving the puck straight away so there is motion to interpolate
+    server.match.puck.lastTouched = True
+    runner = loop.create_task(server.run())
+    rng = random.Random(1)
+    errors = []
+    while not runner.done():
+        for client in clients:
+            client.sendInput(rng.randrange(16))
+            state = client.interpolate()
+            if state:
+                errors.append(abs(state['puck'][0] - server.match.puck.x))
+        await asyncio.sleep(TICK)
+    for client in clients:
+        stats = client.stats()
+        print(
+            f'{client.name}: {stats["receivedPerSecond"]:.0f} B/s down, '
+            f'{stats["sentPerSecond"]:.0f} B/s up, RTT {stats["rtt"]*1000:.0f} ms, '
+            f'tick lag {stats["tickLag"]:.1f}'
+            )
+    stats = server.link.stats()
+    print(f'Server: {stats["sentPerSecond"]:.0f} B/s up, {stats["packetsDropped"]} packets dropped')
+    print(f'Mean puck offset from the server: {sum(errors)/max(len(errors), 1):.1f} px')
+    for client in clients:
+        client.close()
+
+async def goalTest(port=5556):
+    ''' Scores goals over a lossless localhost link, checks both clients end on the server's state '''
+    loop = asyncio.get_running_loop()
+    server = MatchServer(seed=0)
+    await loop.create_datagram_endpoint(lambda: server, local_addr=('127.0.0.1', port))
+    clients = [NetworkClient(f'Bot {i}') for i in range(2)]
+    for client in clients:
+        await client.connect('127.0.0.1', port)
+    match = server.match
+    async def play(ticks):
+        for _ in range(ticks):
+            match.tick(server.inputs)
+            server.broadcast()
+            await asyncio.sleep(0.002)
+            for client in clients:
+                client.sendInput(0)
+            await asyncio.sleep(0.002)
+    await play(10)
+    for side in (1, 0):
+        #Sending the puck into a goal, so the next tick scores
+        puck = match.puck
+        puck.lastTouched = True
+        puck.x = puck.r + puck.vel + 1 if side else match.w - puck.r - puck.vel - 1
+        puck.y = match.h/2
+        puck.aim(-1 if side else 1, 0)
+        await play(30)
+    expected = quantize(match)
+    failed = False
+    for client in clients:
+        state = client.history.get(client.latestTick)
+        if state != expected:
+            failed = True
+            print(f'{client.name}: {state}, server {expected}')
+        client.close()
+    print('Goal test ' + ('failed' if failed else f'ok, scores {list(expected[6:8])}'))
+    return not failed
+
+def main(args):
+    ''' Runs a match server, the localhost self test or the goal test '''
+    commands, options = parseArgs(args)
+    command = commands[0] if commands else 'server'
+    if len(commands) > 1 or command not in ('server', 'selftest', 'goaltest'):
+        sys.exit(
+            'Usage: python network.py [server|selftest|goaltest] [--port N] [--latency S]'
+            ' [--loss P] [--time MM:SS] [--score N]'
+            )
+    port = intOption(options, '--port', 5555)
+    latency = floatOption(options, '--latency', 0)
+    loss = floatOption(options, '--loss', 0)
+    if command == 'selftest':
+        asyncio.run(selfTest(5, latency or 0.05, 0.01, loss or 0.05, port))
+        return
+    if command == 'goaltest':
+        sys.exit(0 if asyncio.run(goalTest(port)) else 1)
+    async def serve():
+        loop = asyncio.get_running_loop()
+        server = MatchServer(
+            latency, 0, loss,
+            endTime=options.get('--time', '03:00'),
+            scoreToWin=intOption(options, '--score', 7)
+            )
+        await loop.create_datagram_endpoint(lambda: server, local_addr=('0.0.0.0', port))
+        print(f'Serving on port {port}, waiting for two players')
+        await server.run()
+    asyncio.run(serve())
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
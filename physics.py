@@ -0,0 +1,606 @@
+'''
+This module defines the headless game physics.
+It has no pygame dependency, so matches can be stepped without a display.
+Includes:
+    1. Mallet
+    2. Puck
+    3. Spatial hash broadphase
+    4. Match
+    5. Snapshot ring buffer
+'''
+import math
+import random
+from array import array
+
+#Length of one physics tick in seconds
+TICK = 1/60
+#Longest frame time simulated, so a stall does not snowball into more ticks
+MAX_FRAME_TIME = 0.25
+#Input bitmask flags
+UP, DOWN, LEFT, RIGHT = 1, 2, 4, 8
+#Size of the rink in logical coordinates, whatever the window or render size
+WIDTH, HEIGHT = 1000, 500
+#Goal mouth on the left and right boundaries
+GOAL_TOP, GOAL_BOTTOM = HEIGHT//2 - 75, HEIGHT//2 + 75
+#Serve angles of a fresh puck, and the same as unit direction vectors
+SERVE_ANGLES = (math.pi-0.01, -0.01)
+SERVE_DIRECTIONS = tuple((math.cos(angle), math.sin(angle)) for angle in SERVE_ANGLES)
+
+class Mallet:
+    ''' Class that defines the physics of a game mallet '''
+    def __init__(self, x, y, r, xLimits=None, yLimits=None):
+        self.x = self.defaultX = x
+        self.y = self.defaultY = y
+        self.r = r
+        self.xLimits = xLimits
+        self.yLimits = yLimits
+        self.vel = 10
+        self.score = 0
+        self.name = None
+
+    def reset(self):
+        ''' Moves the mallet back to its starting position '''
+        self.x = self.defaultX
+        self.y = self.defaultY
+
+    def move(self, inputs):
+        ''' Moves the mallet according to an input bitmask '''
+        if inputs & UP and self.y >= self.yLimits[0]+self.vel+self.r:
+            self.y -= self.vel
+        if inputs & DOWN and self.y <= self.yLimits[1]-self.vel-self.r:
+            self.y += self.vel
+        if inputs & LEFT and self.x >= self.xLimits[0]+self.vel+self.r+5:
+            self.x -= self.vel
+        if inputs & RIGHT and self.x <= self.xLimits[1]-self.vel-self.r-5:
+            self.x += self.vel
+
+    def checkCollision(self, puck):
+        ''' Checks for collision between mallet and puck, and bounces puck '''
+        dx = puck.x - self.x
+        dy = puck.y - self.y
+        reach = self.r + puck.r + puck.vel
+        #Most ticks the puck is out of reach, which needs no square root
+        d2 = dx*dx + dy*dy
+        if d2 > reach*reach:
+            return False
+        dist = math.sqrt(d2) - reach
+        #Sending the puck along the contact normal, straight right if dead above or below
+        if not dx:
+            dx = 1
+            d2 = 1 + dy*dy
+        d = math.sqrt(d2)
+        nx, ny = dx/d, dy/d
+
+        if puck.lastTouched != self:
+            puck.vel += puck.incrementVel
+        puck.lastTouched = self
+        puck.hits += 1
+        puck.aim(nx, ny)
+        puck.x -= dist*nx
+        puck.y -= dist*ny
+        puck.move()
+        return True
+
+    def separate(self, puck, x, y):
+        ''' Pushes the puck out of a mallet at (x, y), returns the contact normal '''
+        dx = (puck.x - x) or 1
+        dy = puck.y - y
+        d = math.hypot(dx, dy)
+        nx, ny = dx/d, dy/d
+        if d < self.r + puck.r:
+            puck.x = x + nx*(self.r + puck.r)
+            puck.y = y + ny*(self.r + puck.r)
+        return nx, ny
+
+    def hitPuck(self, puck, x, y):
+        ''' Bounces the puck off the mallet at (x, y) along the contact normal '''
+        nx, ny = self.separate(puck, x, y)
+        if puck.lastTouched != self:
+            puck.vel += puck.incrementVel
+        puck.lastTouched = self
+        puck.hits += 1
+        puck.aim(nx, ny)
+
+class Puck:
+    ''' Class that defines the physics of the game puck '''
+    def __init__(self, x, y, r, xLimits=None, yLimits=None, direction=None):
+        self.x = self.defaultX = x
+        self.y = self.defaultY = y
+        self.r = r
+        #Speed, and the velocity vector it is the length of
+        self.vel = self.defaultVel = 10
+        self.aim(*(direction or random.choice(SERVE_DIRECTIONS)))
+        self.xLimits = xLimits
+        self.yLimits = yLimits
+        self.lastTouched = None
+        self.incrementVel = 0.5
+        self.scored = False
+        #Running counts of wall bounces and mallet hits, read by telemetry
+        self.bounces = self.hits = 0
+
+    def aim(self, dx, dy):
+        ''' Points the velocity along a unit direction at the current speed '''
+        self.vx = self.vel*dx
+        self.vy = self.vel*dy
+
+    def reset(self, direction, served=True):
+        ''' Puts the puck back at its starting position, in play unless not served '''
+        self.x = self.defaultX
+        self.y = self.defaultY
+        self.vel = self.defaultVel
+        self.aim(*direction)
+        self.lastTouched = True if served else None
+        self.scored = False
+
+    def isCollided(self):
+        ''' Checks for collision with boundaries '''
+        if self.x - (self.r + self.vel) <= self.xLimits[0]: #Left Boundary
+            return 'left'
+        if self.x + self.r + self.vel >= self.xLimits[1]: #Right boundary
+            return 'right'
+        if self.y + self.r + self.vel >= self.yLimits[1]: #Lower Boundary
+            return 'down'
+        if self.y - (self.r + self.vel) <= self.yLimits[0]: #Upper boundary
+            return 'up'
+        return False
+
+    def checkGoal(self):
+        ''' Checks whether a goal is scored '''
+        goalYBounds = all([
+            self.y - self.r >= GOAL_TOP,
+            self.y + self.r <= GOAL_BOTTOM
+            ])
+        goalXBounds = any([
+            self.x - (self.r + self.vel) <= self.xLimits[0],
+            self.x + self.r + self.vel >= self.xLimits[1]
+            ])
+        return goalYBounds and goalXBounds
+
+    def bounce(self, direction):
+        ''' Bounces the puck from the boundaries '''
+        if direction in ['up', 'down']:
+            self.bounces += 1
+            self.vy = -self.vy
+            if direction == 'up':
+                self.y = self.yLimits[0] + (self.r + self.vel)
+            else:
+                self.y = self.yLimits[1] - (self.r + self.vel)
+        else:
+            if self.checkGoal():
+                self.scored = True
+                return
+            self.bounces += 1
+            self.vx = -self.vx
+            if direction == 'left':
+                self.x = self.xLimits[0] + self.r + self.vel
+            else:
+                self.x = self.xLimits[1] - (self.r +self.vel)
+
+    def move(self):
+        ''' Handles puck movement '''
+        collided = self.isCollided()
+        if collided:
+            self.bounce(collided)
+        if self.lastTouched:
+            self.x += self.vx
+            self.y += self.vy
+
+    def inGoalMouth(self):
+        ''' Checks whether the puck fits inside the goal mouth '''
+        return self.y - self.r >= GOAL_TOP and self.y + self.r <= GOAL_BOTTOM
+
+    def wallImpact(self, vx, vy, limit):
+        ''' Returns the time of the first boundary impact within limit, and the boundary '''
+        impact, wall = limit, None
+        for v, pos, low, high, walls in (
+            (vx, self.x, self.xLimits[0], self.xLimits[1], ('left', 'right')),
+            (vy, self.y, self.yLimits[0], self.yLimits[1], ('up', 'down'))
+            ):
+            if v < 0:
+                t, side = (low + self.r - pos)/v, walls[0]
+            elif v > 0:
+                t, side = (high - self.r - pos)/v, walls[1]
+            else:
+                continue
+            if t < impact:
+                impact, wall = max(t, 0), side
+        return impact, wall
+
+    def clamp(self):
+        ''' Keeps the puck inside the boundaries '''
+        self.x = min(max(self.x, self.xLimits[0] + self.r), self.xLimits[1] - self.r)
+        self.y = min(max(self.y, self.yLimits[0] + self.r), self.yLimits[1] - self.r)
+
+    def sweep(self, mallets, starts, maxBounces=4):
+        ''' Moves the puck through one tick, resolving each impact at its exact time '''
+        t = 0
+        for _ in range(maxBounces + 1):
+            vx, vy = (self.vx, self.vy) if self.lastTouched else (0, 0)
+            impact, hit = self.wallImpact(vx, vy, 1 - t)
+            #Mallets move in a straight line from their start position during the tick
+            for mallet, (x0, y0) in zip(mallets, starts):
+                mvx, mvy = mallet.x - x0, mallet.y - y0
+                toi = impactTime(
+                    self.x - (x0 + mvx*t), self.y - (y0 + mvy*t),
+                    vx - mvx, vy - mvy, self.r + mallet.r
+                    )
+                if toi is not None and toi < impact:
+                    impact, hit = toi, mallet
+            self.x += vx*impact
+            self.y += vy*impact
+            t += impact
+            if hit is None:
+                break
+            if hit in ('up', 'down'):
+                self.bounces += 1
+                self.vy = -self.vy
+            elif hit in ('left', 'right'):
+                if self.inGoalMouth():
+                    self.scored = True
+                    return
+                self.bounces += 1
+                self.vx = -self.vx
+            else:
+                x0, y0 = starts[mallets.index(hit)]
+                hit.hitPuck(self, x0 + (hit.x - x0)*t, y0 + (hit.y - y0)*t)
+        #Separating the puck from mallets it is still pressed against
+        for mallet in mallets:
+            mallet.separate(self, mallet.x, mallet.y)
+        self.clamp()
+
+def collidePucks(a, b):
+    ''' Bounces two touching pucks of equal mass off each other '''
+    dx = b.x - a.x
+    dy = b.y - a.y
+    reach = a.r + b.r
+    d2 = dx*dx + dy*dy
+    if d2 >= reach*reach:
+        return False
+    d = math.sqrt(d2)
+    if not d:
+        dx, d = 1, 1
+    nx, ny = dx/d, dy/d
+    #Pushing both pucks apart by half of the overlap
+    overlap = (reach - d)/2
+    a.x -= nx*overlap
+    a.y -= ny*overlap
+    b.x += nx*overlap
+    b.y += ny*overlap
+    #A puck waiting for its serve is at rest
+    avx, avy = (a.vx, a.vy) if a.lastTouched else (0, 0)
+    bvx, bvy = (b.vx, b.vy) if b.lastTouched else (0, 0)
+    approach = (avx - bvx)*nx + (avy - bvy)*ny
+    if approach <= 0:
+        return True
+    #Swapping the velocity components along the contact normal
+    for puck, vx, vy, sign in ((a, avx, avy, -1), (b, bvx, bvy, 1)):
+        puck.vx = vx + sign*approach*nx
+        puck.vy = vy + sign*approach*ny
+        puck.vel = math.hypot(puck.vx, puck.vy)
+        puck.lastTouched = puck.lastTouched or True
+    return True
+
+class SpatialHash:
+    ''' Class that buckets circles into a uniform grid to find nearby pairs '''
+    def __init__(self, cellSize=64):
+        self.cellSize = cellSize
+        self.cells = {}
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, item, x, y, r):
+        ''' Adds an item to every cell its bounding box overlaps '''
+        size = self.cellSize
+        cells = self.cells
+        for i in range(int((x - r)//size), int((x + r)//size) + 1):
+            for j in range(int((y - r)//size), int((y + r)//size) + 1):
+                cell = cells.get((i, j))
+                if cell is None:
+                    cells[(i, j)] = [item]
+                else:
+                    cell.append(item)
+
+    def pairs(self):
+        ''' Returns each pair of items sharing a cell once '''
+        seen = set()
+        pairs = []
+        for cell in self.cells.values():
+            for i, a in enumerate(cell):
+                for b in cell[i+1:]:
+                    key = (id(a), id(b))
+                    if key not in seen:
+                        seen.add(key)
+                        pairs.append((a, b))
+        return pairs
+
+def impactTime(dx, dy, ux, uy, dist):
+    ''' Returns when two circles moving apart by (ux, uy) from (dx, dy) touch, or None '''
+    b = dx*ux + dy*uy
+    if b >= 0:
+        return None
+    c = dx*dx + dy*dy - dist*dist
+    if c <= 0:
+        return 0
+    a = ux*ux + uy*uy
+    disc = b*b - a*c
+    if disc < 0:
+        return None
+    return (-b - math.sqrt(disc))/a
+
+def parseTime(text):
+    ''' Converts a MM:SS string to seconds '''
+    minutes, seconds = text.split(':')
+    return int(minutes)*60 + int(seconds)
+
+def formatTime(seconds):
+    ''' Converts whole seconds to a MM:SS string '''
+    return ':'.join(str(val).zfill(2) for val in divmod(int(seconds), 60))
+
+def malletPositions(w, h, teamSize=1):
+    ''' Returns the starting positions of the left and right teams' mallets '''
+    #A lone mallet guards the goal, a second one plays forward
+    xs = (75, w//2 - 125)[:teamSize]
+    return [(x, h//2-10) for x in xs], [(w - x, h//2-10) for x in xs]
+
+def puckPositions(w, h, n, r=20):
+    ''' Returns the starting positions of n pucks, in a grid around the centre '''
+    if n == 1:
+        return [(w//2, h//2)]
+    spacing = 2*r + 4
+    rows = min(n, max(1, (h - 2*r)//spacing))
+    columns = -(-n//rows)
+    return [
+        (w//2 + (i//rows - (columns - 1)/2)*spacing, h//2 + (i % rows - (rows - 1)/2)*spacing)
+        for i in range(n)
+        ]
+
+class Match:
+    ''' Class that runs a game of air hockey without a display '''
+    def __init__(self, w=WIDTH, h=HEIGHT, mallets=None, puck=None, **kwargs):
+        self.w, self.h = w, h
+        if mallets is None:
+            left, right = malletPositions(w, h, kwargs.get('teamSize', 1))
+            mallets = [Mallet(x, y, 35, (0, w//2), (0, h)) for x, y in left] + [
+                Mallet(x, y, 35, (w//2, w), (0, h)) for x, y in right
+                ]
+        self.mallets = mallets
+        #Mallets are on the left or right team by the half they start in
+        self.teams = (
+            [mallet for mallet in mallets if mallet.defaultX < w//2],
+            [mallet for mallet in mallets if mallet.defaultX >= w//2]
+            )
+        pucks = kwargs.get('pucks')
+        if pucks is None and puck:
+            pucks = [puck]
+        elif pucks is None:
+            pucks = [
+                Puck(x, y, 20, (0, w), (0, h))
+                for x, y in puckPositions(w, h, kwargs.get('puckCount', 1))
+                ]
+        self.pucks = pucks
+        #The first puck, which single puck code such as the CPU player follows
+        self.puck = pucks[0]
+        #Seeding the serve angles so a match can be replayed from its inputs
+        seed = kwargs.get('seed')
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        #Serve directions drawn so far, which is all of the random state a snapshot needs
+        self.serves = 0
+        for puck in pucks:
+            puck.aim(*self.serveDirection())
+        #Pucks are bounced off each other through a uniform grid of cells
+        self.grid = SpatialHash(kwargs.get('cellSize', 64))
+        self.scoreToWin = kwargs.get('scoreToWin', 7)
+        self.endTime = kwargs.get('endTime', '01:00')
+        self.endSeconds = parseTime(self.endTime)
+        #Swept collisions find exact impact times, so fast pucks never tunnel
+        self.swept = kwargs.get('swept', False)
+        self.maxBounces = kwargs.get('maxBounces', 4)
+        self.ticks = 0
+        self.accumulator = 0
+        #Codes of what last touched each puck, as stored in snapshots
+        self.touchCodes = {None: 0, True: 1}
+        self.touchCodes.update((mallet, i + 2) for i, mallet in enumerate(mallets))
+        self.touchedBy = [None, True] + mallets
+
+    @property
+    def time(self):
+        ''' Seconds of play elapsed '''
+        return self.ticks*TICK
+
+    @property
+    def elapsedTime(self):
+        ''' Play time elapsed as a MM:SS string '''
+        return formatTime(self.time)
+
+    @property
+    def timeUp(self):
+        return self.ticks >= round(self.endSeconds/TICK)
+
+    @property
+    def over(self):
+        return self.timeUp or any(
+            mallet.score >= self.scoreToWin for mallet in self.mallets
+            )
+
+    def getWinner(self):
+        ''' Compares team scores and returns the first mallet of the winning team '''
+        team = self.getWinningTeam()
+        return team[0] if team else None
+
+    def getWinningTeam(self):
+        ''' Compares team scores and returns the winning team, None on a draw '''
+        left, right = self.teams
+        if left[0].score == right[0].score:
+            return None
+        return left if left[0].score > right[0].score else right
+
+    def goal(self, puck=None):
+        ''' Adds up the score of the scoring side and serves a new puck '''
+        puck = puck or self.puck
+        leftSide = puck.x < self.w//2
+        for mallet in self.mallets:
+            #Play carries on around the other pucks, so only a lone puck resets the mallets
+            if len(self.pucks) == 1:
+                mallet.reset()
+            if (mallet.defaultX < self.w//2) != leftSide:
+                mallet.score += 1
+        puck.reset(self.serveDirection())
+
+    def serveDirection(self):
+        self.serves += 1
+        return self.rng.choice(SERVE_DIRECTIONS)
+
+    def tick(self, inputs=(0, 0)):
+        ''' Advances the match by one physics tick, returns True on a goal '''
+        if self.over:
+            return False
+        starts = [(mallet.x, mallet.y) for mallet in self.mallets]
+        for mallet, mask in zip(self.mallets, inputs):
+            mallet.move(mask)
+        for puck in self.pucks:
+            if self.swept:
+                puck.sweep(self.mallets, starts, self.maxBounces)
+            else:
+                puck.move()
+                for mallet in self.mallets:
+                    if not puck.scored:
+                        mallet.checkCollision(puck)
+        if len(self.pucks) > 1:
+            self.collidePucks()
+        scored = [puck for puck in self.pucks if puck.scored]
+        for puck in scored:
+            self.goal(puck)
+        #A lone puck's goal stops the clock for the faceoff, several pucks play on
+        if scored and len(self.pucks) == 1:
+            return True
+        self.ticks += 1
+        return bool(scored)
+
+    def collidePucks(self):
+        ''' Bounces touching pucks off each other, returns the number of collisions '''
+        grid = self.grid
+        grid.clear()
+        for puck in self.pucks:
+            grid.insert(puck, puck.x, puck.y, puck.r)
+        return sum(collidePucks(a, b) for a, b in grid.pairs())
+
+    @property
+    def stateSize(self):
+        ''' Number of values in a snapshot of the match '''
+        return 3 + 3*len(self.mallets) + 7*len(self.pucks)
+
+    def snapshot(self, out=None, offset=0):
+        ''' Writes the match state as floats into out from offset, returns out '''
+        if out is None:
+            out = [0.0]*self.stateSize
+        out[offset] = self.ticks
+        out[offset + 1] = self.accumulator
+        out[offset + 2] = self.serves
+        i = offset + 3
+        for mallet in self.mallets:
+            out[i] = mallet.x
+            out[i + 1] = mallet.y
+            out[i + 2] = mallet.score
+            i += 3
+        touchCodes = self.touchCodes
+        for puck in self.pucks:
+            out[i] = puck.x
+            out[i + 1] = puck.y
+            out[i + 2] = puck.vel
+            out[i + 3] = puck.vx
+            out[i + 4] = puck.vy
+            out[i + 5] = touchCodes[puck.lastTouched]
+            out[i + 6] = puck.scored
+            i += 7
+        return out
+
+    def restore(self, state, offset=0, scores=True):
+        ''' Puts the match back in the state of a snapshot, keeping the scores if not scores '''
+        self.ticks = int(state[offset])
+        self.accumulator = state[offset + 1]
+        serves = int(state[offset + 2])
+        if serves != self.serves:
+            #Drawing the serves again, which is cheaper than copying the generator state each tick
+            self.rng.seed(self.seed)
+            for _ in range(serves):
+                self.rng.choice(SERVE_DIRECTIONS)
+            self.serves = serves
+        i = offset + 3
+        for mallet in self.mallets:
+            mallet.x = state[i]
+            mallet.y = state[i + 1]
+            if scores:
+                mallet.score = int(state[i + 2])
+            i += 3
+        touchedBy = self.touchedBy
+        for puck in self.pucks:
+            puck.x = state[i]
+            puck.y = state[i + 1]
+            puck.vel = state[i + 2]
+            puck.vx = state[i + 3]
+            puck.vy = state[i + 4]
+            puck.lastTouched = touchedBy[int(state[i + 5])]
+            puck.scored = bool(state[i + 6])
+            i += 7
+
+    def step(self, dt, inputs=(0, 0)):
+        ''' Advances the match by dt seconds of fixed ticks, returns the goals scored '''
+        self.accumulator += dt
+        goals = 0
+        while self.accumulator >= TICK and not self.over:
+            self.accumulator -= TICK
+            goals += self.tick(inputs)
+        return goals
+
+class SnapshotBuffer:
+    ''' Class that keeps the last few seconds of match snapshots in a fixed ring buffer '''
+    def __init__(self, match, seconds=5):
+        self.match = match
+        self.stride = match.stateSize
+        self.capacity = max(1, round(seconds/TICK))
+        #One preallocated block, so capturing a tick allocates nothing
+        self.data = array('d', bytes(8*self.stride*self.capacity))
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def capture(self):
+        ''' Adds a snapshot of the match, overwriting the oldest when full '''
+        self.match.snapshot(self.data, self.head*self.stride)
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def offset(self, index):
+        ''' Returns where a snapshot starts, counting from the oldest, negative from the newest '''
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('snapshot index out of range')
+        return ((self.head - self.size + index) % self.capacity)*self.stride
+
+    def restore(self, index=-1, scores=True):
+        ''' Puts the match back in the state of a captured snapshot '''
+        self.match.restore(self.data, self.offset(index), scores)
+
+    def get(self, index=-1):
+        ''' Returns a copy of a captured snapshot '''
+        start = self.offset(index)
+        return self.data[start:start + self.stride].tolist()
+
+    def rewind(self, ticks):
+        ''' Restores the snapshot from ticks captures ago, dropping it and the ones after it,
+        returns False when there is nothing to rewind to '''
+        if not self.size or ticks < 1:
+            return False
+        index = max(self.size - ticks, 0)
+        self.restore(index)
+        self.head = (self.head - (self.size - index)) % self.capacity
+        self.size = index
+        return True
+
+    def clear(self):
+        self.head = self.size = 0
@@ -0,0 +1,130 @@
+'''
+This module defines the per-frame phase profiler.
+When disabled, a phase costs one attribute check and a shared no-op context.
+Includes:
+    1. Profiler
+    2. Shared profiler
+'''
+import json
+import os
+import time
+from collections import deque
+import pygame
+from fonts import getFont
+
+class NullPhase:
+    ''' Context manager that does nothing, used while profiling is off '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+class Phase:
+    ''' Context manager that times one phase of a frame '''
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+class Profiler:
+    ''' Class that times the phases of each frame and keeps rolling averages '''
+    def __init__(self, enabled=False, window=120):
+        self.enabled = enabled
+        self.frames = deque(maxlen=window)
+        self.frameTimes = deque(maxlen=window)
+        self.current = {}
+        self.frameStart = None
+        self.trace = None
+        self.showOverlay = False
+        self.origin = time.perf_counter()
+
+    def phase(self, name):
+        ''' Returns a context manager timing the named phase '''
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def record(self, name, start, end):
+        ''' Adds a timed phase to the current frame '''
+        self.current[name] = self.current.get(name, 0) + end - start
+        if self.trace is not None:
+            self.trace.append({
+                'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 1,
+                'ts': (start - self.origin)*1e6, 'dur': (end - start)*1e6
+                })
+
+    def beginFrame(self):
+        if self.enabled:
+            self.frameStart = time.perf_counter()
+
+    def endFrame(self):
+        ''' Closes the current frame and adds it to the rolling window '''
+        if not self.enabled or self.frameStart is None:
+            return
+        end = time.perf_counter()
+        self.record('frame', self.frameStart, end)
+        self.frameTimes.append(end - self.frameStart)
+        self.frames.append(self.current)
+        self.current = {}
+
+    def averages(self):
+        ''' Returns the mean time of each phase in ms over the rolling window '''
+        totals = {}
+        for frame in self.frames:
+            for name, duration in frame.items():
+                totals[name] = totals.get(name, 0) + duration
+        return {name: total/len(self.frames)*1000 for name, total in totals.items()}
+
+    @property
+    def fps(self):
+        if not self.frameTimes:
+            return 0
+        return len(self.frameTimes)/sum(self.frameTimes)
+
+    def toggleOverlay(self):
+        self.showOverlay = self.enabled and not self.showOverlay
+
+    def drawOverlay(self, screen, pos=(10, 40)):
+        ''' Draws the rolling phase times and FPS, returns the area drawn '''
+        if not self.showOverlay:
+            return None
+        font = getFont('Consolas', 16)
+        lines = [f'FPS {self.fps:.0f}'] + [
+            f'{name} {ms:.2f} ms' for name, ms in sorted(self.averages().items())
+            ]
+        x, y = pos
+        rect = None
+        #Rendering directly, as the changing numbers would churn the text cache
+        for line in lines:
+            drawn = screen.blit(font.render(line, 1, (0, 0, 0)), (x, y))
+            rect = rect.union(drawn) if rect else drawn
+            y += drawn.h
+        return rect
+
+    def handleEvent(self, event):
+        ''' Toggles the overlay with F3 '''
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            self.toggleOverlay()
+
+    def startTrace(self):
+        ''' Starts recording every phase for export '''
+        self.enabled = True
+        self.trace = []
+
+    def saveTrace(self, path):
+        ''' Writes the recorded phases as a Chrome trace / Perfetto JSON file '''
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.trace or [], 'displayTimeUnit': 'ms'}, f)
+
+#Profiler shared by every screen
+profiler = Profiler()
@@ -0,0 +1,136 @@
+'''
+This module defines match recording and replay.
+A replay file holds a header with the match seed, rules and player names,
+followed by run-length encoded input records of both players' bitmasks.
+Includes:
+    1. Recorder
+    2. Replay
+Usage:
+    python replay.py FILE.ahr [--render]
+'''
+import struct
+import sys
+import time
+from commandline import parseArgs
+from physics import Match, formatTime
+
+MAGIC = b'AHRP'
+VERSION = 1
+#Magic, version, seed, score to win, end time in seconds, swept collisions
+HEADER = struct.Struct('<4sBQBHB')
+#Input bitmasks of both players and the number of ticks they were held
+RECORD = struct.Struct('<BH')
+MAX_RUN = 0xFFFF
+
+def packInputs(inputs):
+    ''' Packs both players' input bitmasks into one byte '''
+    return inputs[0] | inputs[1] << 4
+
+def unpackInputs(mask):
+    ''' Splits a packed input byte into both players' bitmasks '''
+    return mask & 0xF, mask >> 4
+
+class Recorder:
+    ''' Class that appends the per-tick inputs of a match to a replay file '''
+    def __init__(self, path, match, names=('', '')):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, match.seed, match.scoreToWin,
+            match.endSeconds, match.swept
+            ))
+        for name in names:
+            name = (name or '').encode('utf-8')[:255]
+            self.file.write(bytes([len(name)]) + name)
+        self.mask = None
+        self.run = 0
+
+    def record(self, inputs):
+        ''' Records the inputs of one tick '''
+        mask = packInputs(inputs)
+        if mask == self.mask and self.run < MAX_RUN:
+            self.run += 1
+            return
+        self.flush()
+        self.mask, self.run = mask, 1
+
+    def flush(self):
+        ''' Appends the current run of inputs to the file '''
+        if self.run:
+            self.file.write(RECORD.pack(self.mask, self.run))
+            self.run = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class Replay:
+    ''' Class that reads a replay file and plays it back '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, self.seed, self.scoreToWin, endSeconds, self.swept = (
+            HEADER.unpack_from(data)
+            )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} replay file')
+        self.endTime = formatTime(endSeconds)
+        offset = HEADER.size
+        self.names = []
+        for _ in range(2):
+            length = data[offset]
+            self.names.append(data[offset+1:offset+1+length].decode('utf-8'))
+            offset += 1 + length
+        #Ignoring a partly written record at the end of the file
+        end = offset + (len(data) - offset)//RECORD.size*RECORD.size
+        self.records = list(RECORD.iter_unpack(data[offset:end]))
+
+    @property
+    def ticks(self):
+        return sum(run for _, run in self.records)
+
+    def inputs(self):
+        ''' Yields the input bitmasks of both players for each tick '''
+        for mask, run in self.records:
+            inputs = unpackInputs(mask)
+            for _ in range(run):
+                yield inputs
+
+    def createMatch(self, **kwargs):
+        ''' Returns a match with the recorded seed and rules '''
+        return Match(
+            seed=self.seed,
+            scoreToWin=self.scoreToWin,
+            endTime=self.endTime,
+            swept=bool(self.swept),
+            **kwargs
+            )
+
+    def play(self, match=None):
+        ''' Plays the replay back headless at unlimited speed, returns the match '''
+        match = match or self.createMatch()
+        for inputs in self.inputs():
+            match.tick(inputs)
+        return match
+
+def main(args):
+    ''' Plays back a replay file, headless or in a window with --render '''
+    paths, options = parseArgs(args, switches=('--render',))
+    if len(paths) != 1:
+        sys.exit('Usage: python replay.py FILE.ahr [--render]')
+    replay = Replay(paths[0])
+    if '--render' in options:
+        import pygame
+        from main import Game, createWindow
+        from scenes import SceneManager
+        SceneManager().run(Game(createWindow(), replay.names, replay=replay))
+        pygame.quit()
+        return
+    start = time.perf_counter()
+    match = replay.play()
+    elapsed = time.perf_counter() - start
+    scores = ' - '.join(str(mallet.score) for mallet in match.mallets)
+    print(f'{" vs ".join(replay.names)}: {scores} after {match.elapsedTime}')
+    print(f'Replayed {replay.ticks} ticks in {elapsed*1000:.1f} ms')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,77 @@
+'''
+This module defines the scene stack that drives every screen.
+One loop paces all frames, and the screen on top of the stack gets the
+events, updates and draws, while the ones below stay suspended.
+Includes:
+    1. Scene manager
+'''
+import pygame
+from profiler import profiler
+
+class SceneManager:
+    ''' Class that runs the game loop over a stack of screens '''
+    def __init__(self):
+        self.stack = []
+        self.clock = pygame.time.Clock()
+
+    @property
+    def top(self):
+        return self.stack[-1] if self.stack else None
+
+    def push(self, scene):
+        ''' Suspends the current screen and shows scene on top of it '''
+        if self.top:
+            self.top.suspend()
+        scene.manager = self
+        self.stack.append(scene)
+        scene.enter()
+
+    def pop(self):
+        ''' Leaves the current screen and resumes the one below it '''
+        scene = self.stack.pop()
+        scene.leave()
+        if self.top:
+            self.top.resume()
+        return scene
+
+    def replace(self, scene):
+        ''' Swaps the current screen for scene '''
+        self.stack.pop().leave()
+        scene.manager = self
+        self.stack.append(scene)
+        scene.enter()
+
+    def quit(self):
+        ''' Leaves every screen, which ends the loop '''
+        while self.stack:
+            self.stack.pop().leave()
+
+    def run(self, scene=None):
+        ''' Runs frames until the stack is empty '''
+        if scene:
+            self.push(scene)
+        while self.stack:
+            profiler.beginFrame()
+            dt = self.clock.get_time()/1000
+            with profiler.phase('events'):
+                for event in pygame.event.get():
+                    profiler.handleEvent(event)
+                    if event.type == pygame.QUIT:
+                        self.quit()
+                        break
+                    #Later events go to whichever screen an earlier one brought up
+                    self.top.handleEvent(event)
+                    if not self.stack:
+                        break
+            if not self.stack:
+                break
+            self.top.update(dt)
+            #The update may have changed or emptied the stack
+            scene = self.top
+            if scene is None:
+                break
+            with profiler.phase('render'):
+                scene.redrawGame()
+            with profiler.phase('sleep'):
+                self.clock.tick(scene.FPS)
+            profiler.endFrame()
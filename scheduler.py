@@ -0,0 +1,72 @@
+'''
+This module defines the timing helpers of the game loop.
+Includes:
+    1. Scheduler
+    2. Phase monitor
+'''
+import heapq
+import itertools
+import time
+
+class Scheduler:
+    ''' Class that runs timed events off the main loop's clock '''
+    def __init__(self):
+        self.now = 0
+        self.events = []
+        self.counter = itertools.count()
+
+    def after(self, delay, callback):
+        ''' Schedules callback to run delay seconds from now '''
+        heapq.heappush(self.events, (self.now + delay, next(self.counter), callback))
+
+    def cancel(self):
+        ''' Drops all pending events '''
+        self.events.clear()
+
+    @property
+    def pending(self):
+        return bool(self.events)
+
+    def update(self, dt):
+        ''' Advances the clock by dt seconds and runs the events that are due '''
+        self.now += dt
+        while self.events and self.events[0][0] <= self.now:
+            _, _, callback = heapq.heappop(self.events)
+            callback()
+
+class PhaseMonitor:
+    ''' Class that measures wall and CPU time spent in each game phase '''
+    def __init__(self):
+        self.phase = None
+        self.wall = {}
+        self.cpu = {}
+        self.lastWall = time.perf_counter()
+        self.lastCpu = time.process_time()
+
+    def enter(self, phase):
+        ''' Charges the time since the last switch to the current phase '''
+        wall, cpu = time.perf_counter(), time.process_time()
+        if self.phase is not None:
+            self.wall[self.phase] = self.wall.get(self.phase, 0) + wall - self.lastWall
+            self.cpu[self.phase] = self.cpu.get(self.phase, 0) + cpu - self.lastCpu
+        self.phase = phase
+        self.lastWall, self.lastCpu = wall, cpu
+
+    def stats(self):
+        ''' Returns the wall time, CPU time and idle share of each phase '''
+        self.enter(self.phase)
+        return {
+            phase: {
+                'wall': wall,
+                'cpu': self.cpu[phase],
+                'idle': max(0, 1 - self.cpu[phase]/wall) if wall else 1
+                }
+            for phase, wall in self.wall.items()
+            }
+
+    def report(self):
+        ''' Returns the phase stats as printable lines '''
+        return '\n'.join(
+            f'{phase}: {s["wall"]:.2f}s wall, {s["cpu"]:.2f}s CPU, {s["idle"]:.0%} idle'
+            for phase, s in self.stats().items()
+            )
@@ -0,0 +1,229 @@
+'''
+This module defines the spectator wall.
+It steps many headless matches at once, driven by controllers or replay
+files, and draws them as scaled down tiles of one view. The fields and
+labels are drawn once into the background, and every frame the pucks,
+mallets and scores of all tiles go to the screen in one batch of blits.
+Includes:
+    1. Tile
+    2. Spectator wall screen
+Usage:
+    python spectator.py [CONTROLLER CONTROLLER] [REPLAY.ahr ...] [--tiles N]
+        [--time MM:SS] [--score N] [--seed N] [--fps N] [--profile]
+    Controllers are as in tournament.py, cpu:hard against cpu:medium by default
+'''
+import math
+import os
+import sys
+import time
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+import pygame
+from commandline import parseArgs
+from display import display
+from fonts import renderText
+from physics import Match, MAX_FRAME_TIME, TICK, WIDTH, HEIGHT
+from profiler import profiler
+from replay import Replay
+from scenes import SceneManager
+from sprites import Player, Ball, RED, BLUE
+from tournament import createController
+from widgets import DirtyRenderer, Screen
+
+#Colour of the tile labels and scores
+BLACK = (0, 0, 0)
+#Seconds a finished match stays up before the tile starts the next one
+HOLD_TIME = 2
+#Pixels between neighbouring tiles
+TILE_GAP = 6
+
+class Tile:
+    ''' Class for one match of the wall and the area it is drawn in '''
+    def __init__(self, rect, players=None, replay=None, seed=0, **options):
+        self.rect = rect
+        self.scale = rect.w/WIDTH
+        self.players = players
+        self.replay = replay
+        self.seed = seed
+        self.options = options
+        self.games = 0
+        self.start()
+
+    @property
+    def label(self):
+        return ' vs '.join(self.replay.names if self.replay else self.players)
+
+    def start(self):
+        ''' Starts the next match of the tile '''
+        if self.replay:
+            self.match = self.replay.createMatch()
+            self.inputs = self.replay.inputs()
+            self.controllers = None
+        else:
+            seed = self.seed + self.games
+            self.match = Match(seed=seed, **self.options)
+            self.controllers = [
+                createController(spec, seed + side) for side, spec in enumerate(self.players)
+                ]
+        self.games += 1
+        self.bodies = self.match.mallets + self.match.pucks
+        self.previous = [(body.x, body.y) for body in self.bodies]
+        self.finished = False
+        self.held = 0
+
+    def tick(self):
+        ''' Advances the match by one tick, starting the next once it has been held over '''
+        match = self.match
+        if not self.finished:
+            if self.controllers:
+                inputs = [
+                    controller.getInput(match, mallet)
+                    for controller, mallet in zip(self.controllers, match.mallets)
+                    ]
+            else:
+                inputs = next(self.inputs, None)
+            self.finished = inputs is None or match.over
+        if self.finished:
+            self.held += TICK
+            if self.held >= HOLD_TIME:
+                self.start()
+            return
+        previous = self.previous
+        for i, body in enumerate(self.bodies):
+            previous[i] = (body.x, body.y)
+        if match.tick(inputs):
+            #Not drawing the serve as a slide back to the centre
+            self.previous = [(body.x, body.y) for body in self.bodies]
+
+class SpectatorWall(Screen):
+    ''' Class for the screen that shows many matches as tiles '''
+    #Fields scaled to each tile size, shared by every wall
+    tileGrounds = {}
+
+    def __init__(self, screen, count=16, players=None, replays=None, FPS=None, **options):
+        super().__init__(screen, FPS=FPS, fontsize=12)
+        players = players or ['cpu:hard', 'cpu:medium']
+        seed = options.pop('seed', 0)
+        #Tiles keep the field's 2:1 shape, in as square a grid as fits
+        cols = math.ceil(math.sqrt(count))
+        rows = math.ceil(count/cols)
+        scale = min((self.w/cols - TILE_GAP)/WIDTH, (self.h/rows - TILE_GAP)/HEIGHT)
+        size = int(WIDTH*scale), int(HEIGHT*scale)
+        self.tiles = []
+        for i in range(count):
+            rect = pygame.Rect(0, 0, *size)
+            rect.center = (self.w*(2*(i % cols) + 1)//(2*cols), self.h*(2*(i//cols) + 1)//(2*rows))
+            if replays:
+                tile = Tile(rect, replay=replays[i % len(replays)])
+            else:
+                #Swapping sides every other tile
+                tile = Tile(rect, players[::1 if i % 2 == 0 else -1], seed=seed + i*1000, **options)
+            self.tiles.append(tile)
+        self.tileSprites = self.getSprites(scale)
+        self.renderer = DirtyRenderer(self.screen, self.getBackground(size))
+        self.accumulator = 0
+        self.alpha = 1
+        self.frames = 0
+        self.startTime = None
+
+    def getTileGround(self, size):
+        ''' Returns the hockey field scaled to a tile, rendered once per tile size '''
+        ground = SpectatorWall.tileGrounds.get(size)
+        if ground is None:
+            ground = pygame.transform.smoothscale(self.getHockeyGround(), size)
+            SpectatorWall.tileGrounds[size] = ground
+        return ground
+
+    def getBackground(self, size):
+        ''' Draws every tile's field and label once '''
+        background = pygame.Surface((self.w, self.h))
+        if pygame.display.get_surface():
+            background = background.convert()
+        background.fill(BLACK)
+        ground = self.getTileGround(size)
+        for tile in self.tiles:
+            background.blit(ground, tile.rect)
+            label = renderText(self.font, tile.label, BLACK)
+            background.blit(label, label.get_rect(midbottom=(tile.rect.centerx, tile.rect.bottom - 2)))
+        return background
+
+    def getSprites(self, scale):
+        ''' Returns the surfaces and offsets of the mallets and pucks at the tile scale '''
+        match = self.tiles[0].match
+        sprites = []
+        for mallet in match.mallets:
+            colour = RED if mallet in match.teams[0] else BLUE
+            sprites.append(Player(0, 0, max(2, round(mallet.r*scale)), colour))
+        for puck in match.pucks:
+            sprites.append(Ball(0, 0, max(2, round(puck.r*scale))))
+        #The Player and Ball visuals, blitted centred on each body
+        return [(sprite.getSurface(), sprite.r + 2) for sprite in sprites]
+
+    def enter(self):
+        self.startTime = time.perf_counter()
+        self.renderer.invalidate()
+
+    @property
+    def fps(self):
+        elapsed = time.perf_counter() - self.startTime if self.startTime else 0
+        return self.frames/elapsed if elapsed else 0
+
+    def handleEvent(self, event):
+        ''' Leaves the wall on escape '''
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            self.manager.pop()
+
+    def update(self, dt):
+        ''' Runs the fixed physics ticks of every tile that fit in dt seconds '''
+        self.accumulator += min(dt, MAX_FRAME_TIME)
+        with profiler.phase('physics'):
+            while self.accumulator >= TICK:
+                self.accumulator -= TICK
+                for tile in self.tiles:
+                    tile.tick()
+        self.alpha = self.accumulator/TICK
+
+    def redrawGame(self):
+        ''' Redraws the pucks, mallets and scores of every tile in one batch '''
+        self.renderer.clear()
+        alpha = self.alpha
+        batch = []
+        with profiler.phase('sprites'):
+            for tile in self.tiles:
+                ox, oy = tile.rect.topleft
+                scale = tile.scale
+                for body, (px, py), (surface, pad) in zip(tile.bodies, tile.previous, self.tileSprites):
+                    x = px + (body.x - px)*alpha
+                    y = py + (body.y - py)*alpha
+                    batch.append((surface, (int(ox + x*scale) - pad, int(oy + y*scale) - pad)))
+                left, right = tile.match.teams
+                text = renderText(self.font, f'{left[0].score} - {right[0].score}', BLACK)
+                batch.append((text, (tile.rect.centerx - text.get_width()//2, oy + 2)))
+            self.renderer.add(*self.screen.blits(batch))
+        self.renderer.add(profiler.drawOverlay(self.screen))
+        with profiler.phase('display'):
+            self.renderer.update()
+        self.frames += 1
+
+def main(args):
+    ''' Shows a wall of matches between controllers, or of replay files '''
+    positional, options = parseArgs(args, switches=('--profile',))
+    replays = [Replay(arg) for arg in positional if arg.endswith('.ahr')]
+    players = [arg for arg in positional if not arg.endswith('.ahr')]
+    pygame.display.init()
+    window = display.open((WIDTH, HEIGHT))
+    pygame.display.set_caption('Air Hockey! Spectator wall')
+    profiler.enabled = '--profile' in options
+    wall = SpectatorWall(
+        window, int(options.get('--tiles', len(replays) or 16)),
+        players=players, replays=replays,
+        FPS=int(options.get('--fps', 60)),
+        seed=int(options.get('--seed', 0)),
+        endTime=options.get('--time', '03:00'),
+        scoreToWin=int(options.get('--score', 7))
+        )
+    SceneManager().run(wall)
+    print(f'{len(wall.tiles)} tiles at {wall.fps:.1f} FPS')
+    pygame.quit()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
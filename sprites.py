@@ -1,25 +1,67 @@
 '''
 This module defines game sprites.
+Sprites are drawn between their last two physics positions,
+so motion stays smooth at any frame rate.
 Includes:
-    1. Player
-    2. Ball
+    1. Interpolated
+    2. Prerendered
+    3. Player
+    4. Ball
 '''
-import math
-import random
 import pygame
+from fonts import getFont, renderText
+from physics import Mallet, Puck, UP, DOWN, LEFT, RIGHT
 
-class Player(pygame.sprite.Sprite):
-    ''' Class that defines the game mallets '''
+#Colours of the left and right teams
+RED = (255, 55, 55)
+BLUE = (20, 20, 255)
+
+class Interpolated:
+    ''' Mixin that draws a physics body between its previous and current positions '''
+    def savePosition(self):
+        ''' Remembers the position before a physics tick '''
+        self.prevX, self.prevY = self.x, self.y
+
+    def renderPosition(self, alpha=1):
+        ''' Returns the position to draw at, alpha of the way into the tick '''
+        return (
+            self.prevX + (self.x - self.prevX)*alpha,
+            self.prevY + (self.y - self.prevY)*alpha
+            )
+
+class Prerendered:
+    ''' Mixin that blits a sprite from a surface rendered once per radius and colour '''
+    surfaceCache = {}
+
+    def getSurface(self):
+        ''' Returns the cached surface of the sprite, rendering it on first use '''
+        key = (type(self).__name__, self.r, self.colour)
+        surface = self.surfaceCache.get(key)
+        if surface is None:
+            size = 2*(self.r + 2)
+            surface = pygame.Surface((size, size))
+            if pygame.display.get_surface():
+                surface = surface.convert()
+            #A run length encoded colour key blits faster than per pixel alpha
+            colourKey = (255, 0, 255) if self.colour != (255, 0, 255) else (0, 255, 0)
+            surface.fill(colourKey)
+            self.render(surface, (self.r + 2, self.r + 2))
+            surface.set_colorkey(colourKey, pygame.RLEACCEL)
+            self.surfaceCache[key] = surface
+        return surface
+
+    def blitSurface(self, screen, pos):
+        ''' Blits the cached surface centred on pos, returns the area drawn '''
+        pad = self.r + 2
+        return screen.blit(self.getSurface(), (int(pos[0]) - pad, int(pos[1]) - pad))
+
+class Player(Interpolated, Prerendered, Mallet, pygame.sprite.Sprite):
+    ''' Class that draws the game mallets '''
     def __init__(self, x, y, r, colour, xLimits=None, yLimits=None, **kwargs):
-        super().__init__()
-        self.x = self.defaultX = x
-        self.y = self.defaultY = y
-        self.r = r
+        Mallet.__init__(self, x, y, r, xLimits, yLimits)
+        pygame.sprite.Sprite.__init__(self)
+        self.savePosition()
         self.colour = colour
-        self.xLimits = xLimits
-        self.yLimits = yLimits
-        self.vel = 10
-        self.score = 0
         self.name = kwargs.get('name')
         arrowKeyControls = kwargs.get('arrowKeyControls')
         controls = kwargs.get('controls')  or arrowKeyControls
@@ -37,126 +79,50 @@ class Player(pygame.sprite.Sprite):
         else:
             self.controls = controls
 
-    def checkCollision(self, ball):
-        ''' Checks for collision between player and ball, and bounces ball '''
-        dist = math.sqrt((self.x-ball.x)**2 + (self.y-ball.y)**2) - (self.r + ball.r + ball.vel)
-        if dist > 0:
-            return False
-        dx = -(self.x - ball.x)
-        dy = self.y - ball.y
-        tangent = math.atan2(dy, dx or 1)
-        ball.angle = -tangent
-
-        if ball.lastTouched != self:
-            ball.vel += ball.incrementVel
-        ball.lastTouched = self
-        ball.x += dist*math.cos(ball.angle)*(-1)
-        ball.y += dist*math.sin(ball.angle)*(-1)
-        ball.move()
-
-    def checkMovement(self):
-        ''' Checks for key pressed for player movement '''
+    def readInput(self):
+        ''' Returns the pressed controls as an input bitmask '''
         keys = pygame.key.get_pressed()
-        for control, key in self.controls.items():
-            if keys[key]:
-                if control == 'Up' and self.y >= self.yLimits[0]+self.vel+self.r:
-                    self.y -= self.vel
-                elif control == 'Down' and self.y <= self.yLimits[1]-self.vel-self.r:
-                    self.y += self.vel
-                elif control == 'Left' and self.x >= self.xLimits[0]+self.vel+self.r+5:
-                    self.x -= self.vel
-                elif control == 'Right' and self.x <= self.xLimits[1]-self.vel-self.r-5:
-                    self.x += self.vel
+        return sum(
+            flag for control, flag in zip(self.controls, (UP, DOWN, LEFT, RIGHT))
+            if keys[self.controls[control]]
+            )
 
     def drawScore(self, screen):
         ''' Draws the players score '''
-        font = pygame.font.SysFont('Segoe UI Black', 30)
-        text = font.render(f'Score: {self.score}', 1, (0, 0, 0))
+        text = renderText(getFont('Segoe UI Black', 30), f'Score: {self.score}', (0, 0, 0))
         if self.x < screen.get_width()//2:
-            screen.blit(text, (self.xLimits[0] + 10, 0))
-        else:
-            screen.blit(text, (self.xLimits[1] - 150, 0))
+            return screen.blit(text, (self.xLimits[0] + 10, 0))
+        return screen.blit(text, (self.xLimits[1] - 150, 0))
 
-    def update(self, screen):
-        ''' Updates the player sprite '''
-        if self.controls:
-            self.checkMovement()
-            self.drawScore(screen)
-        pygame.draw.circle(screen, (0, 0, 0), (self.x, self.y), self.r+1, 1)
-        pygame.draw.circle(screen, self.colour, (self.x, self.y), self.r)
+    def render(self, surface, pos):
+        ''' Draws the mallet onto its cached surface '''
+        pygame.draw.circle(surface, (0, 0, 0), pos, self.r+1, 1)
+        pygame.draw.circle(surface, self.colour, pos, self.r)
         spacing = 4
         for i in range(1, 3):
-            pygame.draw.circle(screen, (0, 0, 0), (self.x, self.y), self.r-spacing*i, 1)
-        pygame.draw.circle(screen, (0, 0, 0), (self.x, self.y), self.r//4, 2)
+            pygame.draw.circle(surface, (0, 0, 0), pos, self.r-spacing*i, 1)
+        pygame.draw.circle(surface, (0, 0, 0), pos, self.r//4, 2)
+
+    def update(self, screen, alpha=1):
+        ''' Draws the player sprite, returns the areas drawn '''
+        rects = [self.blitSurface(screen, self.renderPosition(alpha))]
+        if self.controls:
+            rects.append(self.drawScore(screen))
+        return rects
 
-class Ball(pygame.sprite.Sprite):
-    ''' Class that defines the game puck '''
+class Ball(Interpolated, Prerendered, Puck, pygame.sprite.Sprite):
+    ''' Class that draws the game puck '''
     def __init__(self, x, y, r, xLimits=None, yLimits=None, colour=(255, 255, 255)):
-        super().__init__()
-        self.x = x
-        self.y = y
-        self.r = r
+        Puck.__init__(self, x, y, r, xLimits, yLimits)
+        pygame.sprite.Sprite.__init__(self)
+        self.savePosition()
         self.colour = colour
-        self.vel = 10
-        self.xLimits = xLimits
-        self.yLimits = yLimits
-        self.angle = random.choice([math.pi-0.01, -0.01])
-        self.lastTouched = None
-        self.incrementVel = 0.5
-
-    def isCollided(self):
-        ''' Checks for collision with boundaries '''
-        if self.x - (self.r + self.vel) <= self.xLimits[0]: #Left Boundary
-            return 'left'
-        if self.x + self.r + self.vel >= self.xLimits[1]: #Right boundary
-            return 'right'
-        if self.y + self.r + self.vel >= self.yLimits[1]: #Lower Boundary
-            return 'down'
-        if self.y - (self.r + self.vel) <= self.yLimits[0]: #Upper boundary
-            return 'up'
-        return False
-
-    def checkGoal(self):
-        ''' Checks whether a goal is scored '''
-        goalYBounds = all([
-            self.y - self.r >= 175,
-            self.y + self.r <= 325
-            ])
-        goalXBounds = any([
-            self.x - (self.r + self.vel) <= self.xLimits[0],
-            self.x + self.r + self.vel >= self.xLimits[1]
-            ])
-        return goalYBounds and goalXBounds
-
-    def bounce(self, direction):
-        ''' Bounces the ball from the boundaries '''
-        if direction in ['up', 'down']:
-            self.angle = -self.angle
-            if direction == 'up':
-                self.y = self.yLimits[0] + (self.r + self.vel)
-            else:
-                self.y = self.yLimits[1] - (self.r + self.vel)
-        else:
-            if self.checkGoal():
-                self.kill()
-                return
-            self.angle = math.pi - self.angle
-            if direction == 'left':
-                self.x = self.xLimits[0] + self.r + self.vel
-            else:
-                self.x = self.xLimits[1] - (self.r +self.vel)
 
-    def move(self):
-        ''' Handles ball movement '''
-        collided = self.isCollided()
-        if collided:
-            self.bounce(collided)
-        self.x += self.vel*math.cos(self.angle)*bool(self.lastTouched)
-        self.y += self.vel*math.sin(self.angle)*bool(self.lastTouched)
+    def render(self, surface, pos):
+        ''' Draws the puck onto its cached surface '''
+        pygame.draw.circle(surface, (0, 0, 0), pos, self.r+1, 1)
+        pygame.draw.circle(surface, self.colour, pos, self.r)
 
-    def update(self, screen):
-        ''' Updates ball sprite '''
-        if self.xLimits:
-            self.move()
-        pygame.draw.circle(screen, (0, 0, 0), (self.x, self.y), self.r+1, 1)
-        pygame.draw.circle(screen, self.colour, (self.x, self.y), self.r)
+    def update(self, screen, alpha=1):
+        ''' Draws the ball sprite, returns the areas drawn '''
+        return [self.blitSurface(screen, self.renderPosition(alpha))]
@@ -0,0 +1,307 @@
+'''
+This module records per-tick match telemetry into NumPy columns.
+The columns are preallocated for the whole match, so recording a tick only
+stores numbers, and a match is flushed to a .npz file or to a folder of
+.npy files that later analysis memory maps instead of reading.
+Includes:
+    1. Telemetry recorder
+    2. Telemetry files
+    3. Shot, possession and speed analysis
+Usage:
+    python telemetry.py PATH [...] [--bins N] [--heatmap FILE.png] [--output FILE.npz]
+    Paths are recordings, or folders searched for *.npz and *.telemetry recordings
+'''
+import glob
+import json
+import os
+import sys
+import numpy as np
+from commandline import parseArgs
+from physics import GOAL_TOP, GOAL_BOTTOM, TICK
+
+#Dtypes of the columns with one value per tick
+COLUMNS = {
+    'tick': np.int32,
+    'puckX': np.float32,
+    'puckY': np.float32,
+    'puckSpeed': np.float32,
+    #Index of the mallet that last touched the puck, -1 before anyone has
+    'possession': np.int8,
+    #Wall bounces of the puck during the tick
+    'bounces': np.uint8,
+    #Index of the mallet whose hit sent the puck on target, -1 for none
+    'shot': np.int8,
+    #Team that scored during the tick, -1 for none
+    'goal': np.int8
+    }
+#Dtypes of the columns with one value per mallet per tick
+MALLET_COLUMNS = {
+    'malletX': np.float32,
+    'malletY': np.float32
+    }
+#Puck speed histogram range of the analysis
+MAX_SPEED = 40
+
+class TelemetryRecorder:
+    ''' Class that writes the state of the first puck and the mallets into columns each tick '''
+    def __init__(self, match, capacity=None):
+        self.match = match
+        self.mallets = match.mallets
+        self.malletCount = len(match.mallets)
+        #Ticks of a full match, and one more per goal that stops the clock
+        if capacity is None:
+            capacity = round(match.endSeconds/TICK) + 2*match.scoreToWin + 1
+        self.columns = {name: np.empty(capacity, dtype) for name, dtype in COLUMNS.items()}
+        self.columns.update(
+            (name, np.empty((capacity, self.malletCount), dtype))
+            for name, dtype in MALLET_COLUMNS.items()
+            )
+        self.bind()
+        self.teamOf = [0 if mallet in match.teams[0] else 1 for mallet in match.mallets]
+        self.count = 0
+        #Puck counters at the last tick, to store the bounces and hits of each tick
+        self.lastBounces = match.puck.bounces
+        self.lastHits = match.puck.hits
+        #A mallet pushing the puck along hits it every tick, which is one shot
+        self.lastShot = -1
+        self.scores = [match.teams[0][0].score, match.teams[1][0].score]
+
+    def bind(self):
+        ''' Keeps the columns as attributes, saving a dictionary lookup per column each tick '''
+        for name, column in self.columns.items():
+            setattr(self, name, column)
+
+    def grow(self):
+        ''' Doubles the capacity of every column, which only a very long match needs '''
+        for name, column in self.columns.items():
+            grown = np.empty((len(column)*2,) + column.shape[1:], column.dtype)
+            grown[:len(column)] = column
+            self.columns[name] = grown
+        self.bind()
+
+    def isOnTarget(self, puck, team):
+        ''' Checks whether the puck heads into the other team's goal, bouncing off the side walls '''
+        match = self.match
+        goalX = match.w - puck.r if team == 0 else puck.r
+        if not puck.vx or (goalX - puck.x)*puck.vx <= 0:
+            return False
+        y = puck.y + puck.vy*(goalX - puck.x)/puck.vx
+        #Unfolding the bounces off the top and bottom walls
+        span = match.h - 2*puck.r
+        y = (y - puck.r) % (2*span)
+        if y > span:
+            y = 2*span - y
+        y += puck.r
+        return GOAL_TOP + puck.r <= y <= GOAL_BOTTOM - puck.r
+
+    def record(self):
+        ''' Adds the state after a tick '''
+        i = self.count
+        if i == len(self.tick):
+            self.grow()
+        match = self.match
+        puck = match.puck
+        self.tick[i] = match.ticks
+        self.puckX[i] = puck.x
+        self.puckY[i] = puck.y
+        self.puckSpeed[i] = puck.vel
+        owner = match.touchCodes[puck.lastTouched] - 2
+        self.possession[i] = owner if owner >= 0 else -1
+        self.bounces[i] = puck.bounces - self.lastBounces
+        self.lastBounces = puck.bounces
+        shot = -1
+        if puck.hits != self.lastHits:
+            self.lastHits = puck.hits
+            if owner >= 0 and self.isOnTarget(puck, self.teamOf[owner]):
+                shot = owner
+        self.shot[i] = shot if shot != self.lastShot else -1
+        self.lastShot = shot
+        goal = -1
+        scores = self.scores
+        for team in (0, 1):
+            score = match.teams[team][0].score
+            if score != scores[team]:
+                scores[team] = score
+                goal = team
+        self.goal[i] = goal
+        malletX, malletY = self.malletX, self.malletY
+        for j in range(self.malletCount):
+            mallet = self.mallets[j]
+            malletX[i, j] = mallet.x
+            malletY[i, j] = mallet.y
+        self.count = i + 1
+
+    def meta(self):
+        ''' Returns the match details stored alongside the columns '''
+        match = self.match
+        return {
+            'seed': match.seed, 'w': match.w, 'h': match.h,
+            'scoreToWin': match.scoreToWin, 'endTime': match.endTime,
+            'teams': self.teamOf, 'ticks': self.count
+            }
+
+    def flush(self, path):
+        ''' Writes the recorded ticks to a .npz file, or to a folder of .npy files '''
+        columns = {name: column[:self.count] for name, column in self.columns.items()}
+        if path.endswith('.npz'):
+            np.savez(path, meta=np.array(json.dumps(self.meta())), **columns)
+            return
+        os.makedirs(path, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(path, name + '.npy'), column)
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta(), f)
+
+class TelemetryFile:
+    ''' Class that opens the columns of a recording only when they are first used '''
+    def __init__(self, path):
+        self.path = path
+        self.npz = np.load(path) if path.endswith('.npz') else None
+        self.columns = {}
+        if self.npz is not None:
+            self.meta = json.loads(str(self.npz['meta']))
+        else:
+            with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            if self.npz is not None:
+                self.columns[name] = self.npz[name]
+            else:
+                #Mapping the file, so only the pages read are loaded
+                self.columns[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self.columns[name]
+
+    def close(self):
+        if self.npz is not None:
+            self.npz.close()
+        self.columns.clear()
+
+def findRecordings(paths):
+    ''' Returns the recordings among paths, searching folders that are not recordings '''
+    recordings = []
+    for path in paths:
+        if path.endswith('.npz') or os.path.exists(os.path.join(path, 'meta.json')):
+            recordings.append(path)
+        elif os.path.isdir(path):
+            recordings.extend(sorted(
+                glob.glob(os.path.join(path, '*.npz')) +
+                glob.glob(os.path.join(path, '*.telemetry'))
+                ))
+    return recordings
+
+class Analysis:
+    ''' Class that sums shot heatmaps, possession and puck speeds over many recordings '''
+    def __init__(self, bins=20):
+        self.bins = bins
+        self.shots = None
+        self.occupancy = None
+        self.speeds = np.zeros(MAX_SPEED*2, np.int64)
+        self.possession = np.zeros(2, np.int64)
+        self.shotCounts = np.zeros(2, np.int64)
+        self.goals = np.zeros(2, np.int64)
+        self.bounces = 0
+        self.ticks = 0
+        self.matches = 0
+
+    def add(self, recording):
+        ''' Adds one recording, reading only the columns it needs '''
+        meta = recording.meta
+        w, h = meta['w'], meta['h']
+        if self.shots is None:
+            self.size = w, h
+            self.shots = np.zeros((self.bins*w//h, self.bins), np.int64)
+            self.occupancy = np.zeros_like(self.shots)
+        edges = (np.linspace(0, w, self.shots.shape[0] + 1), np.linspace(0, h, self.bins + 1))
+        x, y = recording['puckX'], recording['puckY']
+        shot = recording['shot']
+        fired = shot >= 0
+        self.shots += np.histogram2d(x[fired], y[fired], edges)[0].astype(np.int64)
+        self.occupancy += np.histogram2d(x, y, edges)[0].astype(np.int64)
+        teams = np.array(meta['teams'])
+        possession = recording['possession']
+        owned = possession >= 0
+        self.possession += np.bincount(teams[possession[owned]], minlength=2)
+        self.shotCounts += np.bincount(teams[shot[fired]], minlength=2)
+        goal = recording['goal']
+        self.goals += np.bincount(goal[goal >= 0], minlength=2)
+        speed = np.asarray(recording['puckSpeed'])
+        self.speeds += np.histogram(
+            speed.clip(0, MAX_SPEED - 0.01), len(self.speeds), (0, MAX_SPEED)
+            )[0]
+        self.bounces += int(np.sum(recording['bounces'], dtype=np.int64))
+        self.ticks += len(x)
+        self.matches += 1
+
+    def speedPercentile(self, q):
+        ''' Returns the q-th percentile puck speed from the histogram '''
+        total = self.speeds.sum()
+        if not total:
+            return 0
+        k = np.searchsorted(np.cumsum(self.speeds), q/100*total)
+        return (k + 0.5)*MAX_SPEED/len(self.speeds)
+
+    def report(self):
+        ''' Returns the analysis as text '''
+        share = self.possession/max(self.possession.sum(), 1)
+        lines = [
+            f'Matches {self.matches}, ticks {self.ticks}, wall bounces {self.bounces}',
+            f'{"Team":<8}{"Possession":>12}{"Shots":>8}{"Goals":>8}{"Conversion":>12}'
+            ]
+        for team, name in enumerate(('Left', 'Right')):
+            conversion = self.goals[team]/self.shotCounts[team] if self.shotCounts[team] else 0
+            lines.append(
+                f'{name:<8}{share[team]:>12.1%}{self.shotCounts[team]:>8}'
+                f'{self.goals[team]:>8}{conversion:>12.1%}'
+                )
+        lines.append('Puck speed ' + ', '.join(
+            f'p{q} {self.speedPercentile(q):.1f}' for q in (10, 50, 90, 99)
+            ))
+        #Showing the histogram in steps of 2
+        speeds = self.speeds.reshape(-1, 4).sum(1)
+        peak = max(speeds.max(), 1)
+        for k in np.flatnonzero(speeds):
+            lines.append(f'{2*k:>4} {"#"*max(1, int(40*speeds[k]/peak))} {speeds[k]}')
+        return '\n'.join(lines)
+
+    def saveHeatmap(self, path, scale=4):
+        ''' Draws the shot heatmap over the puck occupancy as an image '''
+        os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+        import pygame
+        shots = self.shots/max(self.shots.max(), 1)
+        occupancy = self.occupancy/max(self.occupancy.max(), 1)
+        #Occupancy in green, shot origins in red
+        pixels = np.zeros(shots.shape + (3,), np.uint8)
+        pixels[..., 0] = (255*np.sqrt(shots)).astype(np.uint8)
+        pixels[..., 1] = (120*np.sqrt(occupancy)).astype(np.uint8)
+        surface = pygame.surfarray.make_surface(pixels.repeat(scale, 0).repeat(scale, 1))
+        pygame.image.save(surface, path)
+
+    def save(self, path):
+        ''' Writes the summed heatmaps and histograms to a .npz file '''
+        np.savez(
+            path, shots=self.shots, occupancy=self.occupancy, speeds=self.speeds,
+            possession=self.possession, shotCounts=self.shotCounts, goals=self.goals
+            )
+
+def main(args):
+    ''' Analyses the recordings given on the command line '''
+    paths, options = parseArgs(args)
+    recordings = findRecordings(paths)
+    if not recordings:
+        print('No telemetry recordings found', file=sys.stderr)
+        sys.exit(1)
+    analysis = Analysis(int(options.get('--bins', 20)))
+    for path in recordings:
+        recording = TelemetryFile(path)
+        analysis.add(recording)
+        recording.close()
+    print(analysis.report())
+    if '--heatmap' in options:
+        analysis.saveHeatmap(options['--heatmap'])
+    if '--output' in options:
+        analysis.save(options['--output'])
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,301 @@
+'''
+This module runs headless tournaments between mallet controllers.
+Matches are spread over a process pool and played at unlimited speed,
+and each result is appended to a JSON lines file as soon as it finishes,
+so an interrupted tournament resumes where it stopped.
+Includes:
+    1. Controllers
+    2. Match jobs
+    3. Round robin and Swiss pairings
+    4. Elo ratings
+Usage:
+    python tournament.py CONTROLLER CONTROLLER [...] [--format roundrobin|swiss]
+        [--rounds N] [--games N] [--workers N] [--output FILE]
+        [--time MM:SS] [--score N] [--seed N] [--telemetry FOLDER]
+    Controllers are idle, random, cpu:easy, cpu:medium, cpu:hard or module:Class
+'''
+import importlib
+import json
+import multiprocessing as mp
+import os
+import random
+import sys
+import time
+from ai import CPUController
+from commandline import parseArgs
+from physics import Match
+
+ELO_START = 1500
+ELO_K = 16
+
+class IdleController:
+    ''' Controller that never moves its mallet '''
+    def __init__(self, seed=None):
+        pass
+
+    def getInput(self, match, mallet):
+        return 0
+
+class RandomController:
+    ''' Controller that holds random inputs for a few ticks at a time '''
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.inputs = 0
+        self.hold = 0
+
+    def getInput(self, match, mallet):
+        if self.hold <= 0:
+            self.inputs = self.rng.randrange(16)
+            self.hold = self.rng.randrange(5, 30)
+        self.hold -= 1
+        return self.inputs
+
+def createController(spec, seed=None):
+    ''' Creates a controller from its name, seeding its randomness '''
+    if spec == 'idle':
+        return IdleController(seed)
+    if spec == 'random':
+        return RandomController(seed)
+    if spec.startswith('cpu:'):
+        return CPUController(spec[4:], seed)
+    moduleName, _, className = spec.partition(':')
+    return getattr(importlib.import_module(moduleName), className)(seed)
+
+def matchSeed(seed, key):
+    ''' Derives the seed of a match from the tournament seed and the match key '''
+    return random.Random(f'{seed}:{key}').randrange(2**32)
+
+def playMatch(job):
+    ''' Plays one match of a job at unlimited speed, returns its result '''
+    start = time.perf_counter()
+    match = Match(seed=job['seed'], **job['options'])
+    controllers = [
+        createController(spec, job['seed'] + side)
+        for side, spec in enumerate(job['players'])
+        ]
+    mallets = match.mallets
+    telemetry = None
+    if job.get('telemetry'):
+        from telemetry import TelemetryRecorder
+        telemetry = TelemetryRecorder(match)
+    while not match.over:
+        match.tick([
+            controller.getInput(match, mallet)
+            for controller, mallet in zip(controllers, mallets)
+            ])
+        if telemetry:
+            telemetry.record()
+    if telemetry:
+        #Keys hold colons, which some file systems do not allow
+        telemetry.flush(os.path.join(job['telemetry'], job['key'].replace(':', '_') + '.telemetry'))
+    #Draws follow the rules of Game.getWinner
+    winner = match.getWinner()
+    return dict(
+        job,
+        scores=[mallet.score for mallet in mallets],
+        winner=None if winner is None else mallets.index(winner),
+        ticks=match.ticks,
+        seconds=time.perf_counter() - start
+        )
+
+def roundRobin(players, games):
+    ''' Returns the keys and sides of every round robin match, swapping sides each game '''
+    pairings = []
+    for game in range(games):
+        for i, a in enumerate(players):
+            for b in players[i+1:]:
+                sides = (a, b) if game % 2 == 0 else (b, a)
+                pairings.append((f'{game}:{sides[0]}:{sides[1]}', sides))
+    return pairings
+
+class Standings:
+    ''' Class that keeps points, records and Elo ratings of every player '''
+    def __init__(self, players):
+        self.players = players
+        self.points = dict.fromkeys(players, 0)
+        self.records = {player: [0, 0, 0] for player in players}
+        self.elo = dict.fromkeys(players, ELO_START)
+        self.opponents = {player: set() for player in players}
+        self.byes = set()
+
+    def add(self, result):
+        ''' Adds a match result or a bye '''
+        if result.get('bye'):
+            self.points[result['players'][0]] += 1
+            self.byes.add(result['players'][0])
+            return
+        a, b = result['players']
+        self.opponents[a].add(b)
+        self.opponents[b].add(a)
+        scoreA = {0: 1, 1: 0, None: 0.5}[result['winner']]
+        self.points[a] += scoreA
+        self.points[b] += 1 - scoreA
+        self.records[a][{1: 0, 0.5: 1, 0: 2}[scoreA]] += 1
+        self.records[b][{0: 0, 0.5: 1, 1: 2}[scoreA]] += 1
+        expected = 1/(1 + 10**((self.elo[b] - self.elo[a])/400))
+        self.elo[a] += ELO_K*(scoreA - expected)
+        self.elo[b] -= ELO_K*(scoreA - expected)
+
+    def ranking(self):
+        ''' Returns the players from first to last '''
+        return sorted(self.players, key=lambda p: (-self.points[p], -self.elo[p], p))
+
+    def report(self):
+        ''' Returns the standings as a text table '''
+        lines = [f'{"Player":<20}{"W":>5}{"D":>5}{"L":>5}{"Pts":>7}{"Elo":>7}']
+        for player in self.ranking():
+            w, d, l = self.records[player]
+            lines.append(
+                f'{player:<20}{w:>5}{d:>5}{l:>5}{self.points[player]:>7g}{self.elo[player]:>7.0f}'
+                )
+        return '\n'.join(lines)
+
+def swissRound(standings, rnd):
+    ''' Pairs players with similar points who have not met yet, returns the pairings and bye '''
+    unpaired = standings.ranking()
+    pairings = []
+    bye = None
+    if len(unpaired) % 2:
+        #Giving the bye to the lowest ranked player who has not had one
+        bye = next((p for p in reversed(unpaired) if p not in standings.byes), unpaired[-1])
+        unpaired.remove(bye)
+    while unpaired:
+        a = unpaired.pop(0)
+        b = next((p for p in unpaired if p not in standings.opponents[a]), unpaired[0])
+        unpaired.remove(b)
+        sides = (a, b) if rnd % 2 == 0 else (b, a)
+        pairings.append((f'{rnd}:{sides[0]}:{sides[1]}', sides))
+    return pairings, bye
+
+class Tournament:
+    ''' Class that runs a tournament over a process pool, streaming results to a file '''
+    def __init__(self, players, output, **kwargs):
+        if len(set(players)) != len(players):
+            raise ValueError('Every controller can only enter once')
+        self.players = list(players)
+        self.output = output
+        self.format = kwargs.get('format', 'roundrobin')
+        self.games = kwargs.get('games', 2)
+        self.rounds = kwargs.get('rounds', max(len(players) - 1, 1))
+        self.workers = kwargs.get('workers') or mp.cpu_count()
+        self.seed = kwargs.get('seed', 0)
+        self.options = {
+            'scoreToWin': kwargs.get('scoreToWin', 7),
+            'endTime': kwargs.get('endTime', '03:00')
+            }
+        #Folder each match's telemetry is written to, None for no telemetry
+        self.telemetry = kwargs.get('telemetry')
+        #Written with every result, so a resumed run only counts results played the same way
+        self.settings = {'format': self.format, 'seed': self.seed, **self.options}
+        self.skipped = 0
+        self.results = self.load()
+        self.played = 0
+        self.elapsed = 0
+
+    def load(self):
+        ''' Reads the results already written by an earlier run with the same settings '''
+        results = {}
+        if not os.path.exists(self.output):
+            return results
+        with open(self.output, 'r', encoding='utf-8') as f:
+            for line in f:
+                #Skipping a line cut short by an interruption
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if result.get('settings') != self.settings:
+                    self.skipped += 1
+                    continue
+                results[result['key']] = result
+        return results
+
+    def job(self, key, players):
+        job = {
+            'key': key, 'players': list(players),
+            'seed': matchSeed(self.seed, key), 'options': self.options,
+            'settings': self.settings
+            }
+        if self.telemetry:
+            job['telemetry'] = self.telemetry
+        return job
+
+    def play(self, pool, pairings, file, log):
+        ''' Plays the pairings not in the results yet, writing each result as it finishes '''
+        jobs = [self.job(key, players) for key, players in pairings if key not in self.results]
+        if not jobs:
+            return
+        start = time.perf_counter()
+        for result in pool.imap_unordered(playMatch, jobs):
+            self.results[result['key']] = result
+            file.write(json.dumps(result) + '\n')
+            file.flush()
+            self.played += 1
+            log(f'{" vs ".join(result["players"])}: {result["scores"][0]} - {result["scores"][1]}')
+        self.elapsed += time.perf_counter() - start
+
+    def run(self, log=print):
+        ''' Plays every match of the tournament, returns the final standings '''
+        if self.telemetry:
+            os.makedirs(self.telemetry, exist_ok=True)
+        with mp.Pool(self.workers) as pool, open(self.output, 'a+', encoding='utf-8') as file:
+            #Ending a line cut short by an interruption before appending
+            if file.tell():
+                file.seek(file.tell() - 1)
+                if file.read(1) != '\n':
+                    file.write('\n')
+            if self.format == 'swiss':
+                standings = Standings(self.players)
+                for rnd in range(self.rounds):
+                    pairings, bye = swissRound(standings, rnd)
+                    if bye and f'{rnd}:bye' not in self.results:
+                        result = {
+                            'key': f'{rnd}:bye', 'players': [bye], 'bye': True,
+                            'settings': self.settings
+                            }
+                        self.results[result['key']] = result
+                        file.write(json.dumps(result) + '\n')
+                    self.play(pool, pairings, file, log)
+                    if bye:
+                        standings.add(self.results[f'{rnd}:bye'])
+                    for key, _ in pairings:
+                        standings.add(self.results[key])
+                return standings
+            pairings = roundRobin(self.players, self.games)
+            self.play(pool, pairings, file, log)
+        standings = Standings(self.players)
+        #Rating in the order the matches were scheduled, so resumed runs agree
+        for key, _ in pairings:
+            standings.add(self.results[key])
+        return standings
+
+    @property
+    def matchesPerSecond(self):
+        return self.played/self.elapsed if self.elapsed else 0
+
+def main(args):
+    ''' Runs a tournament between the controllers given on the command line '''
+    players, options = parseArgs(args)
+    tournament = Tournament(
+        players,
+        options.get('--output', 'tournament.jsonl'),
+        format=options.get('--format', 'roundrobin'),
+        games=int(options.get('--games', 2)),
+        rounds=int(options.get('--rounds', max(len(players) - 1, 1))),
+        workers=int(options.get('--workers', 0)),
+        seed=int(options.get('--seed', 0)),
+        scoreToWin=int(options.get('--score', 7)),
+        endTime=options.get('--time', '03:00'),
+        telemetry=options.get('--telemetry')
+        )
+    resumed = len(tournament.results)
+    if tournament.skipped:
+        print(f'Skipping {tournament.skipped} results in {tournament.output} played with other settings')
+    if resumed:
+        print(f'Resuming with {resumed} results from {tournament.output}')
+    standings = tournament.run()
+    print(standings.report())
+    print(f'Played {tournament.played} matches at {tournament.matchesPerSecond:.1f} matches/s')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,10 +3,13 @@ This module defines game widgets.
 Includes:
     1. Button
     2. Input box
-    3. Basic pygame screen
+    3. Basic pygame screen and scene
+    4. Dirty rect renderer
 '''
 import pygame
-pygame.font.init()
+from display import display
+from fonts import getFont, renderText
+from physics import GOAL_TOP, GOAL_BOTTOM
 #Defining game colours
 WHITE = (255, 255, 255)
 GREEN = (0, 200, 0)
@@ -20,15 +23,16 @@ class Button:
     def __init__(self, screen, position, text, **kwargs):
         self.screen = screen
         self.position = position
-        self.font = pygame.font.SysFont('Garamond', 40)
+        self.font = getFont('Garamond', 40)
         self.bg = kwargs.get('bg', ORANGE)
         self.fg = kwargs.get('fg', RED)
         self.state = kwargs.get('state', 'normal')
         self.center = kwargs.get('center', False)
-        self.text_render = self.font.render(
+        self.text_render = renderText(
+            self.font,
             text.center(len(text) + kwargs.get('pad', 0)), #Centering text
-            1, #Anti-aliasing
-            self.fg #Button foreground colour
+            self.fg, #Button foreground colour
+            1 #Anti-aliasing
             )
         self.render_object = None
 
@@ -46,10 +50,12 @@ class Button:
         pygame.draw.line(self.screen, [abs(val-100) for val in self.bg], (x+w , y+h), (x+w , y), 5)
         pygame.draw.rect(self.screen, [abs(val-50) for val in self.bg], (x, y, w , h))
         self.render_object = self.screen.blit(self.text_render, (x, y))
+        #Including the border lines in the drawn area
+        return self.render_object.inflate(8, 8)
 
     def clicked(self):
         if self.state == 'normal':
-            return self.render_object.collidepoint(pygame.mouse.get_pos())
+            return self.render_object.collidepoint(display.mousePos())
         return False
 
 class InputBox:
@@ -62,23 +68,23 @@ class InputBox:
         self.rect = pygame.Rect(x, y, w, h)
         self.colour = self.colour_inactive
         self.default_text = self.text = text
-        self.font = pygame.font.SysFont('Arial', 50)
-        self.text_surface = self.font.render(text, 1, self.colour)
+        self.font = getFont('Arial', 50)
+        self.text_surface = renderText(self.font, text, self.colour)
         self.active = False
         self.val = ''
 
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
             #If the user clicked on the input box rect.
-            if self.rect.collidepoint(event.pos):
+            if self.rect.collidepoint(display.toLogical(event.pos)):
                 #Toggle the active variable.
                 self.active = not self.active
                 if self.text == '':
                     self.text = self.default_text
                 elif self.text == self.default_text and self.active:
                     self.text = ''
-                self.text_surface = self.font.render(
-                    self.text.center(self.max_length), 1, self.colour
+                self.text_surface = renderText(
+                    self.font, self.text.center(self.max_length), self.colour
                     )
             else:
                 self.active = False
@@ -100,8 +106,8 @@ class InputBox:
             elif len(self.text.strip()) < self.max_length:
                 self.text += event.unicode
             #Re-render the text.
-            self.text_surface = self.font.render(
-                self.text.center(self.max_length), 1, self.colour
+            self.text_surface = renderText(
+                self.font, self.text.center(self.max_length), self.colour
                 )
 
     def update(self):
@@ -114,28 +120,97 @@ class InputBox:
         pygame.draw.rect(screen, self.colour, self.rect, 2)
 
 class Screen:
-    ''' Base class for the pygame game screen '''
-    def __init__(self, screen, FPS=60, fontsize=30):
+    ''' Base class for the pygame game screen, run as a scene of the scene manager '''
+    groundCache = {}
+    #Frame rate cap of every screen, 0 for uncapped
+    defaultFPS = 60
+
+    def __init__(self, screen, FPS=None, fontsize=30):
         self.screen = screen
         self.w, self.h = self.screen.get_size()
         self.sprites = pygame.sprite.Group()
-        self.FPS = FPS
-        self.clock = pygame.time.Clock()
-        self.font = pygame.font.SysFont('Segoe UI Black', fontsize)
+        self.FPS = self.defaultFPS if FPS is None else FPS
+        self.font = getFont('Segoe UI Black', fontsize)
+        self.manager = None
 
-    def drawHockeyGround(self):
-        ''' Draws the hockey field '''
-        self.screen.fill(GREEN)
+    def enter(self):
+        ''' Called when the screen is pushed onto the scene stack '''
+
+    def leave(self):
+        ''' Called when the screen is popped or replaced '''
+
+    def suspend(self):
+        ''' Called when another screen is pushed over this one '''
+
+    def resume(self):
+        ''' Called when this screen is back on top of the stack '''
+
+    def handleEvent(self, event):
+        ''' Handles one event while the screen is on top '''
+
+    def update(self, dt):
+        ''' Advances the screen by dt seconds while it is on top '''
+
+    def getHockeyGround(self):
+        ''' Returns the hockey field, rendered once per screen size '''
+        size = (self.w, self.h)
+        if size in Screen.groundCache:
+            return Screen.groundCache[size]
+        ground = pygame.Surface(size)
+        if pygame.display.get_surface():
+            ground = ground.convert()
+        ground.fill(GREEN)
         #Center line
-        pygame.draw.line(self.screen, WHITE, (self.w//2, 0), (self.w//2, self.h), 5)
+        pygame.draw.line(ground, WHITE, (self.w//2, 0), (self.w//2, self.h), 5)
         #Center circle
-        pygame.draw.circle(self.screen, WHITE, (self.w//2, self.h//2), 75, 5)
+        pygame.draw.circle(ground, WHITE, (self.w//2, self.h//2), 75, 5)
         #The goals
-        pygame.draw.line(self.screen, BLACK, (2, 175), (2, 325), 5)
-        pygame.draw.line(self.screen, BLACK, (self.w-3, 175), (self.w-3, 325), 5)
+        pygame.draw.line(ground, BLACK, (2, GOAL_TOP), (2, GOAL_BOTTOM), 5)
+        pygame.draw.line(ground, BLACK, (self.w-3, GOAL_TOP), (self.w-3, GOAL_BOTTOM), 5)
         #Goal area lines
-        pygame.draw.rect(self.screen, WHITE, (-1, self.h//5, 150, 300), 5)
-        pygame.draw.rect(self.screen, WHITE, (self.w-148, self.h//5, 150, 300), 5)
+        pygame.draw.rect(ground, WHITE, (-1, self.h//5, 150, 300), 5)
+        pygame.draw.rect(ground, WHITE, (self.w-148, self.h//5, 150, 300), 5)
+        Screen.groundCache[size] = ground
+        return ground
+
+    def drawHockeyGround(self):
+        ''' Draws the hockey field '''
+        return self.screen.blit(self.getHockeyGround(), (0, 0))
+
+class DirtyRenderer:
+    ''' Class that repaints and updates only the changed parts of the screen '''
+    def __init__(self, screen, background):
+        self.screen = screen
+        self.background = background
+        self.lastRects = []
+        self.rects = []
+        self.fullUpdate = True
+
+    def invalidate(self):
+        ''' Makes the next frame repaint and update the whole screen '''
+        self.fullUpdate = True
+
+    def clear(self):
+        ''' Repaints the background over everything drawn last frame '''
+        if self.fullUpdate:
+            self.screen.blit(self.background, (0, 0))
+            return
+        self.screen.blits(
+            [(self.background, rect, rect) for rect in self.lastRects], doreturn=False
+            )
+
+    def add(self, *rects):
+        ''' Marks the given rects as drawn this frame '''
+        self.rects.extend(rect for rect in rects if rect)
+
+    def update(self):
+        ''' Pushes this and last frame's rects to the display '''
+        if self.fullUpdate:
+            display.present()
+        else:
+            display.present(self.lastRects + self.rects)
+        self.lastRects, self.rects = self.rects, []
+        self.fullUpdate = False
 
 if __name__ == '__main__':
     import os